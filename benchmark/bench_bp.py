@@ -0,0 +1,112 @@
+# coding:UTF-8
+'''
+BP神经网络的训练基准：在合成的二分类数据上，记录原来的全量梯度下降(bp/bp_train.py 的 bp_train)
+和 mini-batch 训练(bp/bp_sgd.py 的 sgd_train，SGD/Momentum/Adam)达到目标训练准确率所用的时间。
+
+数据为[-4.5, 4.5]之间均匀分布的点，落在半径为3的圆内为一类，其余的特征是噪声。
+bp 目录下的代码是 Python 2，需要用 Python 2 运行。
+
+用法:
+    python2 bench_bp.py --rows 100000 --target 0.95
+    python2 bench_bp.py --rows 10000,100000 --impl full,adam --output bp.json
+'''
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+IMPLS = ['full', 'sgd', 'momentum', 'adam']
+
+
+def make_data(rows, features, seed=0):
+    '''生成合成数据
+    input:  rows(int):样本个数
+            features(int):特征个数(>=2)
+            seed(int):随机种子
+    output: X(array):特征
+            label(array):one-hot的标签，两类
+    '''
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    X = rng.uniform(-4.5, 4.5, (rows, features))
+    y = (X[:, 0] ** 2 + X[:, 1] ** 2 < 9).astype(int)
+    return X, np.eye(2)[y]
+
+
+def run_case(impl, X, label, args):
+    '''训练到目标准确率或者达到最大的迭代次数
+    input:  impl(string):full为bp_train，其它为sgd_train的优化方法
+            X(array):特征
+            label(array):标签
+            args:命令行参数
+    output: result(dict):seconds(用时)/accuracy(最终的训练准确率)/reached(是否达到目标)/steps(迭代次数或者轮数)
+    '''
+    import numpy as np
+    sys.path.insert(0, os.path.join(ROOT, 'bp'))
+    import bp_train
+    import bp_sgd
+    dtype = np.float32 if args.float32 else np.float64
+    np.random.seed(args.seed)  # 权重的初始化相同
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')  # 不输出训练过程中的损失
+    try:
+        start = time.time()
+        if impl == 'full':
+            # bp_train的权重梯度是所有样本的和，学习率按样本个数缩放
+            w0, w1, b0, b1 = bp_train.bp_train(X, label, args.hidden, args.max_cycle, args.alpha_full / X.shape[0],
+                                               2, dtype, target_acc=args.target)
+            steps = None
+        else:
+            lr = {'sgd': args.alpha_sgd, 'momentum': args.alpha_momentum, 'adam': args.alpha_adam}[impl]
+            w0, w1, b0, b1, history = bp_sgd.sgd_train(X, label, args.hidden, args.max_epoch, lr, 2,
+                                                       batch_size=args.batch_size, optimizer=impl, dtype=dtype,
+                                                       seed=args.seed, target_acc=args.target, verbose=False)
+            steps = len(history)
+        seconds = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    acc = bp_train.accuracy(X, label, w0, w1, b0, b1)
+    return {'seconds': seconds, 'accuracy': acc, 'reached': acc >= args.target, 'steps': steps}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='wall-clock time to target accuracy for the BP trainers')
+    parser.add_argument('--impl', default=','.join(IMPLS), help='trainers to run: ' + ','.join(IMPLS))
+    parser.add_argument('--rows', default='100000', help='comma separated row counts')
+    parser.add_argument('--features', type=int, default=2, help='number of features (>=2)')
+    parser.add_argument('--hidden', type=int, default=20, help='hidden units')
+    parser.add_argument('--target', type=float, default=0.95, help='target training accuracy')
+    parser.add_argument('--max-cycle', type=int, default=3000, help='iterations allowed for the full-batch loop')
+    parser.add_argument('--max-epoch', type=int, default=50, help='epochs allowed for mini-batch training')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--alpha-full', type=float, default=10.0, help='full-batch rate, divided by the row count')
+    parser.add_argument('--alpha-sgd', type=float, default=0.5)
+    parser.add_argument('--alpha-momentum', type=float, default=0.5)
+    parser.add_argument('--alpha-adam', type=float, default=0.01)
+    parser.add_argument('--float32', action='store_true', help='train in float32')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='optional JSON result file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for rows in [int(float(r)) for r in args.rows.split(',')]:
+        X, label = make_data(rows, args.features, args.seed)
+        for impl in args.impl.split(','):
+            result = {'impl': impl, 'rows': rows}
+            result.update(run_case(impl, X, label, args))
+            results.append(result)
+            print('%-9s rows=%-8d %8.2fs  acc=%.4f  %s' % (impl, rows, result['seconds'], result['accuracy'],
+                                                         'reached' if result['reached'] else 'NOT reached'))
+    if args.output:
+        meta = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'platform': platform.platform(),
+                'target': args.target, 'hidden': args.hidden, 'batch_size': args.batch_size}
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
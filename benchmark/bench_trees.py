@@ -0,0 +1,224 @@
+# coding:UTF-8
+'''
+决策树的性能基准：用合成数据在不同的样本数、特征数、树的深度和树的个数下，
+记录三种实现的训练时间、预测时间和内存峰值，结果保存成JSON，两次的结果可以对比找出变慢的地方。
+
+    randomForest01   randomForest/randomForest01.py 的随机森林(train_forest)，Python 3
+    cart             cart/train_cart.py 的 CART 回归树(build_tree)，Python 2
+    tree             randomForest/tree.py 的分类树(build_tree)，Python 2
+
+每一组参数在单独的子进程中运行，内存峰值是子进程自己的 ru_maxrss，互不影响。
+树的深度对 randomForest01 和 cart 有效(tree 的 build_tree 没有深度限制)，树的个数只对 randomForest01 有效，
+不适用的参数在结果中为 null，结果文件的 meta.sweeps 记录每个参数覆盖的实现。
+
+用法:
+    python3 bench_trees.py run result.json --rows 1000,10000,100000,1000000 --features 10 --depth 8 --trees 10
+    python3 bench_trees.py run result.json --impl cart,tree --python2 ~/.pyenv/versions/2.7.18/bin/python
+    python3 bench_trees.py compare old.json new.json --threshold 0.2
+'''
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+IMPLS = ['randomForest01', 'cart', 'tree']
+PYTHON = {'randomForest01': 'python3', 'cart': 'python2', 'tree': 'python2'}  # 每种实现使用的解释器
+METRICS = ['fit_time', 'predict_time', 'peak_rss_kb']
+SWEEPS = {'depth': ['randomForest01', 'cart'], 'trees': ['randomForest01']}  # 每个参数对哪些实现有效
+
+
+def make_data(rows, features, seed=0):
+    '''生成合成数据
+    input:  rows(int):样本个数
+            features(int):特征个数
+            seed(int):随机种子
+    output: X(array):[0, 1)之间均匀分布的特征
+            label(array):分类标签1.0/-1.0，由前两个特征的线性组合加噪声决定
+            target(array):回归的目标值，sin(6 * x0) + x1 加噪声
+    '''
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    X = rng.rand(rows, features)
+    x1 = X[:, 1] if features > 1 else 0.0
+    label = np.where(X[:, 0] + 0.5 * x1 + 0.2 * rng.randn(rows) > 0.75, 1.0, -1.0)
+    target = np.sin(6 * X[:, 0]) + x1 + 0.1 * rng.randn(rows)
+    return X, label, target
+
+
+def run_case(case):
+    '''在当前进程中运行一组参数
+    input:  case(dict):impl/rows/features/depth/trees
+    output: result(dict):fit_time/predict_time/peak_rss_kb，单位为秒和KB
+    '''
+    import resource
+    import numpy as np
+    sys.path.insert(0, os.path.join(ROOT, 'randomForest'))
+    sys.path.insert(0, os.path.join(ROOT, 'cart'))
+    from flat_tree import compile_tree, compile_forest, predict_tree, bagging_predict_batch
+    X, label, target = make_data(case['rows'], case['features'])
+
+    if case['impl'] == 'randomForest01':
+        import randomForest01
+        y = (label > 0).astype(np.intp)
+        classes = [-1.0, 1.0]
+        n_features = max(1, int(case['features'] ** 0.5))
+        start = time.time()
+        trees, oob_votes, importances = randomForest01.train_forest(
+            X, y, classes, case['depth'], 1, 1.0, case['trees'], n_features)
+        fit_time = time.time() - start
+        start = time.time()
+        flat_trees, classes = compile_forest(trees)
+        bagging_predict_batch(flat_trees, classes, X)
+        predict_time = time.time() - start
+    elif case['impl'] == 'cart':
+        import train_cart
+        data = np.column_stack((X, target))
+        start = time.time()
+        regression_tree = train_cart.build_tree(data, 3, 0.2, max_depth=case['depth'])
+        fit_time = time.time() - start
+        start = time.time()
+        predict_tree(compile_tree(regression_tree), X)
+        predict_time = time.time() - start
+    elif case['impl'] == 'tree':
+        import tree
+        data = np.column_stack((X, label))
+        start = time.time()
+        classify_tree = tree.build_tree(data)
+        fit_time = time.time() - start
+        start = time.time()
+        predict_tree(compile_tree(classify_tree, classes=[]), X)
+        predict_time = time.time() - start
+    else:
+        raise ValueError('unknown implementation %s' % case['impl'])
+    return {'fit_time': fit_time, 'predict_time': predict_time,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def make_cases(impls, rows, features, depth, trees):
+    '''所有参数的组合，depth和trees只对SWEEPS中的实现有效，其余的实现为None'''
+    cases = []
+    for impl in impls:
+        depth_list = depth if impl in SWEEPS['depth'] else [None]
+        trees_list = trees if impl in SWEEPS['trees'] else [None]
+        for r, f, d, t in itertools.product(rows, features, depth_list, trees_list):
+            cases.append({'impl': impl, 'rows': r, 'features': f, 'depth': d, 'trees': t})
+    return cases
+
+
+def bench(cases, python, timeout):
+    '''每一组参数启动一个子进程运行
+    input:  cases(list):参数的组合
+            python(dict):每种实现使用的解释器
+            timeout(float):每一组参数的最长时间(秒)
+    output: results(list):每一组参数和结果，超时或者出错时status不为ok
+    '''
+    results = []
+    for case in cases:
+        cmd = [python[case['impl']], os.path.abspath(__file__), 'case', json.dumps(case)]
+        result = dict(case)
+        try:
+            out = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+            if out.returncode == 0:
+                result.update(json.loads(out.stdout.decode('utf-8').strip().splitlines()[-1]))
+                result['status'] = 'ok'
+            else:
+                result['status'] = 'error: ' + out.stderr.decode('utf-8').strip().splitlines()[-1]
+        except subprocess.TimeoutExpired:
+            result['status'] = 'timeout'
+        sys.stderr.write('%s\n' % json.dumps(result))
+        results.append(result)
+    return results
+
+
+def case_key(result):
+    return (result['impl'], result['rows'], result['features'], result['depth'], result['trees'])
+
+
+def compare(old, new, threshold, min_seconds=0.05):
+    '''对比两次的结果
+    input:  old, new(dict):两次保存的JSON结果
+            threshold(float):变慢(或者内存增加)超过这个比例时认为是回退
+            min_seconds(float):两次都小于这个时间的不比较，太短的时间误差太大
+    output: regressions(list):(参数, 指标, 旧的值, 新的值, 变化的比例)
+    '''
+    old_results = dict((case_key(r), r) for r in old['results'] if r['status'] == 'ok')
+    regressions = []
+    for result in new['results']:
+        key = case_key(result)
+        if key not in old_results:
+            continue
+        if result['status'] != 'ok':
+            regressions.append((key, 'status', 'ok', result['status'], None))
+            continue
+        for metric in METRICS:
+            before, after = old_results[key][metric], result[metric]
+            if metric != 'peak_rss_kb' and max(before, after) < min_seconds:
+                continue
+            ratio = (after - before) / before if before > 0 else 0.0
+            if ratio > threshold:
+                regressions.append((key, metric, before, after, ratio))
+    return regressions
+
+
+def _int_list(text):
+    return [int(float(x)) for x in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='scaling benchmark for the tree learners')
+    sub = parser.add_subparsers(dest='command')
+    run = sub.add_parser('run', help='run the benchmark and write a JSON result file')
+    run.add_argument('output', help='JSON result file')
+    run.add_argument('--impl', default=','.join(IMPLS), help='implementations to run')
+    run.add_argument('--rows', default='1000,10000,100000,1000000', help='comma separated row counts')
+    run.add_argument('--features', default='10', help='comma separated feature counts')
+    run.add_argument('--depth', default='8', help='comma separated forest depths')
+    run.add_argument('--trees', default='10', help='comma separated forest sizes')
+    run.add_argument('--timeout', type=float, default=600, help='seconds allowed per case')
+    run.add_argument('--python2', default=PYTHON['cart'], help='interpreter for cart and tree')
+    run.add_argument('--python3', default=PYTHON['randomForest01'], help='interpreter for randomForest01')
+    cmp_parser = sub.add_parser('compare', help='flag regressions between two result files')
+    cmp_parser.add_argument('old')
+    cmp_parser.add_argument('new')
+    cmp_parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown')
+    cmp_parser.add_argument('--min-seconds', type=float, default=0.05, help='ignore timings shorter than this')
+    case_parser = sub.add_parser('case')  # 子进程中运行一组参数，结果以JSON写到标准输出
+    case_parser.add_argument('case')
+    args = parser.parse_args(argv)
+
+    if args.command == 'case':
+        sys.stdout.write(json.dumps(run_case(json.loads(args.case))) + '\n')
+    elif args.command == 'run':
+        python = {'randomForest01': args.python3, 'cart': args.python2, 'tree': args.python2}
+        cases = make_cases(args.impl.split(','), _int_list(args.rows), _int_list(args.features),
+                           _int_list(args.depth), _int_list(args.trees))
+        for name in sorted(SWEEPS):
+            sys.stderr.write('--%s sweep covers: %s\n' % (name, ', '.join(SWEEPS[name])))
+        results = bench(cases, python, args.timeout)
+        meta = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'platform': platform.platform(),
+                'python': python, 'sweeps': SWEEPS}
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=1)
+    elif args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.threshold, args.min_seconds)
+        for key, metric, before, after, ratio in regressions:
+            change = '' if ratio is None else ' (%+.0f%%)' % (ratio * 100)
+            print('REGRESSION %s %s: %s -> %s%s' % ('/'.join(str(k) for k in key), metric, before, after, change))
+        print('%d regressions' % len(regressions))
+        return 1 if regressions else 0
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
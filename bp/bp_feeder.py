@@ -0,0 +1,227 @@
+# coding:UTF-8
+'''
+BP神经网络的流式训练：数据不需要全部放进内存。
+
+1、第一次读数据文件时按块(每块CHUNK_ROWS行)解析，特征和标签依次追加到二进制缓存文件
+   <数据文件>.cache.bp_X.bin / <数据文件>.cache.bp_y.bin 中，数据文件的修改时间和大小作为缓存的键，
+   之后直接读缓存，不再解析文本。
+2、训练时把缓存分成若干块(每块block_rows行)，每一轮打乱块的顺序和块内样本的顺序；
+   后台线程把下一块从磁盘读进另一个缓冲区，读文件和计算重叠，内存只有两块的大小。
+3、每个mini-batch用bp_sgd.train_step更新参数，权重和偏置与bp_train相同。
+'''
+import io
+import os
+import sys
+import json
+import time
+import threading
+import numpy as np
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# 解析文本和缓存的键与随机森林共用 randomForest/data_loader.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'randomForest'))
+from data_loader import iter_chunks, CHUNK_ROWS
+from bp_train import init_weights, alloc_buffers, save_model
+from bp_sgd import ADAM, CONSTANT, learning_rate, init_state, train_step
+
+BLOCK_ROWS = 65536  # 训练时每次从磁盘读入的行数
+
+
+def _cache_files(file_name):
+    return ('%s.cache.bp_X.bin' % file_name, '%s.cache.bp_y.bin' % file_name, '%s.cache.bp.json' % file_name)
+
+
+def build_cache(file_name, dtype=np.float64, chunk_rows=CHUNK_ROWS):
+    '''按块解析数据文件，写成二进制缓存，内存只和块的大小有关
+    input:  file_name(string):数据文件，tab分隔，最后一列为类别(0, 1, ..., n_class-1)
+            dtype:特征的浮点类型
+            chunk_rows(int):每一块解析的行数
+    output: meta(dict):rows/n_feature/n_class/dtype
+    '''
+    x_file, y_file, meta_file = _cache_files(file_name)
+    stat = os.stat(file_name)
+    rows, n_feature, n_class = 0, 0, 0
+    with open(x_file, 'wb') as fx, open(y_file, 'wb') as fy:
+        for chunk in iter_chunks(file_name, "\t", np.float64, chunk_rows):
+            np.ascontiguousarray(chunk[:, :-1], dtype=dtype).tofile(fx)
+            y = chunk[:, -1].astype(np.int32)
+            y.tofile(fy)
+            rows += chunk.shape[0]
+            n_feature = chunk.shape[1] - 1
+            n_class = max(n_class, int(y.max()) + 1)
+    meta = {'key': {'mtime': stat.st_mtime, 'size': stat.st_size, 'dtype': np.dtype(dtype).str},
+            'rows': rows, 'n_feature': n_feature, 'n_class': n_class}
+    with open(meta_file, 'w') as f:  # 最后写meta，写到一半失败时缓存不会被当成有效的
+        json.dump(meta, f)
+    return meta
+
+
+def open_cache(file_name, dtype=np.float64):
+    '''打开二进制缓存，缓存不存在或者数据文件有变化时重新生成
+    input:  file_name(string):数据文件
+            dtype:特征的浮点类型
+    output: meta(dict):rows/n_feature/n_class
+            X(memmap):特征，按需从磁盘读入
+            y(memmap):类别
+    '''
+    x_file, y_file, meta_file = _cache_files(file_name)
+    stat = os.stat(file_name)
+    key = {'mtime': stat.st_mtime, 'size': stat.st_size, 'dtype': np.dtype(dtype).str}
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta['key'] != key:
+            meta = build_cache(file_name, dtype)
+    except (IOError, OSError, ValueError, KeyError):
+        meta = build_cache(file_name, dtype)
+    if meta['rows'] == 0:
+        return meta, np.empty((0, meta['n_feature']), dtype=dtype), np.empty(0, dtype=np.int32)
+    X = np.memmap(x_file, dtype=dtype, mode='r', shape=(meta['rows'], meta['n_feature']))
+    y = np.memmap(y_file, dtype=np.int32, mode='r', shape=(meta['rows'],))
+    return meta, X, y
+
+
+def _read_blocks(file_name, meta, blocks, block_rows, buffers, free, ready):
+    '''后台线程：按blocks的顺序把每一块读进空闲的缓冲区'''
+    x_file, y_file, meta_file = _cache_files(file_name)
+    n = meta['n_feature']
+    try:
+        # 不经过Python的缓冲直接读进NumPy数组，读文件时释放GIL，和训练的计算重叠
+        with io.open(x_file, 'rb', buffering=0) as fx, io.open(y_file, 'rb', buffering=0) as fy:
+            for b in blocks:
+                i = free.get()
+                if i is None:  # 训练提前结束
+                    return
+                X_buf, y_buf = buffers[i]
+                begin = b * block_rows
+                rows = min(block_rows, meta['rows'] - begin)
+                fx.seek(begin * n * X_buf.itemsize)
+                fy.seek(begin * y_buf.itemsize)
+                _read_full(fx, X_buf[:rows])
+                _read_full(fy, y_buf[:rows])
+                ready.put((i, rows))
+    except Exception as e:
+        ready.put(e)
+        return
+    ready.put(None)
+
+
+def _read_full(f, out):
+    '''把文件中的数据读满out(readinto一次可能读不满)'''
+    view = memoryview(out.reshape(-1).view(np.uint8))
+    got = 0
+    while got < len(view):
+        size = f.readinto(view[got:])
+        if not size:
+            raise IOError('unexpected end of cache file %s' % f.name)
+        got += size
+
+
+def iter_batches(file_name, batch_size, rng, dtype=np.float64, block_rows=BLOCK_ROWS):
+    '''一轮的所有mini-batch，块的顺序和块内样本的顺序都是随机的
+    input:  file_name(string):数据文件
+            batch_size(int):每个mini-batch的样本个数
+            rng(RandomState):打乱顺序用的随机数
+            dtype:特征的浮点类型
+            block_rows(int):每次从磁盘读入的行数
+    output: 每次返回(batch_feature, batch_label)，one-hot的标签；两个数组在下一次返回前有效
+    '''
+    meta, X, y = open_cache(file_name, dtype)
+    n, n_class = meta['n_feature'], meta['n_class']
+    block_rows = max(min(block_rows, meta['rows']), 1)
+    n_block = (meta['rows'] + block_rows - 1) // block_rows
+    # 两个缓冲区轮流使用：一个训练，一个由后台线程读入下一块
+    buffers = [(np.empty((block_rows, n), dtype=dtype), np.empty(block_rows, dtype=np.int32)) for i in range(2)]
+    batch_feature = np.empty((batch_size, n), dtype=dtype)
+    batch_label = np.empty((batch_size, n_class), dtype=dtype)
+    free, ready = queue.Queue(), queue.Queue()
+    free.put(0)
+    free.put(1)
+    reader = threading.Thread(target=_read_blocks,
+                              args=(file_name, meta, rng.permutation(n_block), block_rows, buffers, free, ready))
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            item = ready.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            i, rows = item
+            X_buf, y_buf = buffers[i]
+            order = rng.permutation(rows)
+            for begin in range(0, rows, batch_size):
+                idx = order[begin:begin + batch_size]
+                k = len(idx)
+                np.take(X_buf, idx, axis=0, out=batch_feature[:k])
+                batch_label[:k] = 0
+                batch_label[np.arange(k), y_buf[idx]] = 1
+                yield batch_feature[:k], batch_label[:k]
+            free.put(i)  # 这一块用完，缓冲区交给后台线程
+    finally:
+        free.put(None)  # 提前结束时通知后台线程退出
+
+
+def stream_train(file_name, n_hidden, n_epoch, alpha, batch_size=64, optimizer=ADAM, schedule=CONSTANT,
+                 decay=0.5, step_size=10, momentum=0.9, dtype=np.float64, seed=None, block_rows=BLOCK_ROWS,
+                 target_acc=None, verbose=True):
+    '''从磁盘流式读入数据，mini-batch训练BP神经网络
+    input:  file_name(string):数据文件，tab分隔，最后一列为类别
+            n_hidden(int):隐含层的节点个数
+            n_epoch(int):最多的轮数
+            alpha(float):初始的学习率
+            batch_size, optimizer, schedule, decay, step_size, momentum:与bp_sgd.sgd_train相同
+            dtype:训练时使用的浮点类型
+            seed(int):打乱顺序的随机种子
+            block_rows(int):每次从磁盘读入的行数，内存占用只和它有关
+            target_acc(float):一轮中训练准确率达到该值就停止，None表示训练n_epoch轮
+            verbose(bool):是否打印每一轮的损失
+    output: w0, w1, b0, b1(mat):权重和偏置，与bp_train相同
+            history(list):每一轮的(轮数, 用时, 损失, 训练准确率)，损失和准确率是这一轮中
+                          每个mini-batch更新前的输出的平均值，不需要再扫描一遍数据
+    '''
+    start = time.time()
+    meta, X, y = open_cache(file_name, dtype)  # 第一次时生成缓存
+    n, n_output = meta['n_feature'], meta['n_class']
+    rng = np.random.RandomState(seed)
+    # 1、初始化，权重的初始化与bp_train相同
+    params = [np.array(x, dtype=dtype) for x in init_weights(n, n_hidden, n_output)]
+    w0, b0, w1, b1 = params
+    batch_size = max(min(batch_size, meta['rows']), 1)
+    buf = alloc_buffers(batch_size, n, n_hidden, n_output, dtype)
+    state = init_state(params, optimizer)
+
+    # 2、训练
+    t = 0
+    history = []
+    for epoch in range(n_epoch):
+        lr = learning_rate(alpha, epoch, n_epoch, schedule, decay, step_size)
+        cost_sum, correct = 0.0, 0
+        for batch_feature, batch_label in iter_batches(file_name, batch_size, rng, dtype, block_rows):
+            t += 1
+            train_step(batch_feature, batch_label, params, buf, state, optimizer, lr, t, momentum)
+            out = buf['output_out'][:len(batch_feature)]
+            cost_sum += float(np.sum(np.square(out - batch_label)))
+            correct += int(np.sum(np.argmax(out, axis=1) == np.argmax(batch_label, axis=1)))
+        cost = (1.0 / 2) * cost_sum / max(meta['rows'], 1)
+        acc = float(correct) / max(meta['rows'], 1)
+        history.append((epoch + 1, time.time() - start, cost, acc))
+        if verbose:
+            print "\t-------- epoch: ", epoch + 1, " ,lr: ", lr, " ,cost: ", cost, " ,acc: ", acc
+        if target_acc is not None and acc >= target_acc:
+            break
+    return np.mat(w0), np.mat(w1), np.mat(b0), np.mat(b1), history
+
+
+if __name__ == "__main__":
+    # 1、流式训练网络模型，第一次运行时生成二进制缓存
+    print "--------- 1.training ------------"
+    w0, w1, b0, b1, history = stream_train("data.txt", 20, 100, 0.01, batch_size=32, seed=1, block_rows=128)
+    # 2、保存最终的模型，与bp_train的模型格式相同
+    print "--------- 2.save model ------------"
+    save_model(w0, w1, b0, b1)
@@ -0,0 +1,188 @@
+# coding:UTF-8
+'''
+BP神经网络的mini-batch训练：每一轮(epoch)打乱样本的顺序，每次只用batch_size个样本计算梯度并更新参数，
+参数更新支持SGD、Momentum和Adam，学习率可以按轮数衰减。
+
+权重和偏置与bp_train相同(w0, w1, b0, b1)，训练好的模型可以直接用bp_train.save_model保存，
+用bp_test中的get_predict预测。
+'''
+import time
+import numpy as np
+from math import cos, pi
+from bp_train import load_data, init_weights, alloc_buffers, compute_grad, accuracy, get_cost, get_predict, save_model
+
+SGD = 'sgd'
+MOMENTUM = 'momentum'
+ADAM = 'adam'
+
+CONSTANT = 'constant'  # 学习率不变
+STEP = 'step'  # 每step_size轮乘以decay
+EXPONENTIAL = 'exponential'  # 每一轮乘以decay
+COSINE = 'cosine'  # 在n_epoch轮内按余弦从alpha降到0
+
+
+def learning_rate(alpha, epoch, n_epoch, schedule=CONSTANT, decay=0.5, step_size=10):
+    '''第epoch轮的学习率
+    input:  alpha(float):初始的学习率
+            epoch(int):当前的轮数，从0开始
+            n_epoch(int):总的轮数
+            schedule(string):CONSTANT、STEP、EXPONENTIAL或者COSINE
+            decay(float):STEP和EXPONENTIAL的衰减系数
+            step_size(int):STEP每隔多少轮衰减一次
+    output: (float):学习率
+    '''
+    if schedule == STEP:
+        return alpha * decay ** (epoch // step_size)
+    if schedule == EXPONENTIAL:
+        return alpha * decay ** epoch
+    if schedule == COSINE:
+        return 0.5 * alpha * (1 + cos(pi * epoch / max(n_epoch, 1)))
+    return alpha
+
+
+def update(params, grads, state, optimizer, lr, t, momentum=0.9, beta1=0.9, beta2=0.999, eps=1e-8):
+    '''按优化方法原地更新参数
+    input:  params(list):参数w0, b0, w1, b1
+            grads(list):对应的梯度(已经除以样本个数)
+            state(list):每个参数的状态，Momentum为速度，Adam为一阶矩和二阶矩
+            optimizer(string):SGD、MOMENTUM或者ADAM
+            lr(float):学习率
+            t(int):已经更新的次数，从1开始，Adam的偏差修正使用
+            momentum(float):Momentum的系数
+            beta1, beta2, eps(float):Adam的参数
+    '''
+    for param, grad, s in zip(params, grads, state):
+        if optimizer == MOMENTUM:
+            velocity = s[0]
+            velocity *= momentum
+            velocity -= lr * grad
+            param += velocity
+        elif optimizer == ADAM:
+            m_t, v_t, buf = s
+            m_t *= beta1
+            m_t += (1 - beta1) * grad
+            v_t *= beta2
+            np.multiply(grad, grad, out=buf)
+            buf *= 1 - beta2
+            v_t += buf
+            # 偏差修正合并到学习率中
+            step = lr * np.sqrt(1 - beta2 ** t) / (1 - beta1 ** t)
+            np.sqrt(v_t, out=buf)
+            buf += eps
+            np.divide(m_t, buf, out=buf)
+            buf *= step
+            param -= buf
+        else:
+            param -= lr * grad
+
+
+def init_state(params, optimizer):
+    '''优化器的状态，每个参数一组，训练过程中原地更新'''
+    if optimizer == ADAM:
+        return [[np.zeros_like(p), np.zeros_like(p), np.empty_like(p)] for p in params]
+    return [[np.zeros_like(p)] for p in params]
+
+
+def train_step(batch_feature, batch_label, params, buf, state, optimizer, lr, t, momentum=0.9):
+    '''用一个mini-batch计算梯度并更新参数
+    input:  batch_feature(array):mini-batch的特征
+            batch_label(array):mini-batch的one-hot标签
+            params(list):参数w0, b0, w1, b1，原地更新
+            buf(dict):bp_train.alloc_buffers分配的缓冲区
+            state(list):init_state得到的优化器状态
+            optimizer(string):SGD、MOMENTUM或者ADAM
+            lr(float):学习率
+            t(int):已经更新的次数，包括这一次
+            momentum(float):Momentum的系数
+    output: buf(dict):output_out的前k行为更新前这个mini-batch的输出
+    '''
+    w0, b0, w1, b1 = params
+    k = np.shape(batch_feature)[0]
+    compute_grad(batch_feature, batch_label, w0, b0, w1, b1, buf)
+    grads = [buf['grad_w0'], buf['grad_b0'], buf['grad_w1'], buf['grad_b1']]
+    for grad in grads:
+        grad *= 1.0 / k  # 梯度为mini-batch的平均值
+    update(params, grads, state, optimizer, lr, t, momentum)
+    return buf
+
+
+def sgd_train(feature, label, n_hidden, n_epoch, alpha, n_output, batch_size=64, optimizer=ADAM,
+              schedule=CONSTANT, decay=0.5, step_size=10, momentum=0.9, dtype=np.float64,
+              seed=None, target_acc=None, verbose=True):
+    '''mini-batch训练BP神经网络
+    input:  feature(mat):特征
+            label(mat):one-hot的标签
+            n_hidden(int):隐含层的节点个数
+            n_epoch(int):最多的轮数，每一轮所有的样本都使用一次
+            alpha(float):初始的学习率
+            n_output(int):输出层的节点个数
+            batch_size(int):每次更新使用的样本个数
+            optimizer(string):SGD、MOMENTUM或者ADAM
+            schedule(string):学习率的衰减方式，见learning_rate
+            decay(float), step_size(int):学习率衰减的参数
+            momentum(float):Momentum的系数
+            dtype:训练时使用的浮点类型
+            seed(int):打乱样本的随机种子
+            target_acc(float):每一轮结束时训练准确率达到该值就停止，None表示训练n_epoch轮
+            verbose(bool):是否打印每一轮的损失
+    output: w0(mat):输入层到隐含层之间的权重
+            w1(mat):隐含层到输出层之间的权重
+            b0(mat):输入层到隐含层之间的偏置
+            b1(mat):隐含层到输出层之间的偏置
+            history(list):每一轮结束时的(轮数, 用时, 损失, 训练准确率)
+    '''
+    start = time.time()
+    m, n = np.shape(feature)
+    rng = np.random.RandomState(seed)
+    # 1、初始化，权重的初始化与bp_train相同
+    w0, b0, w1, b1 = init_weights(n, n_hidden, n_output)
+    feature, label = np.asarray(feature, dtype=dtype), np.asarray(label, dtype=dtype)
+    params = [np.array(x, dtype=dtype) for x in (w0, b0, w1, b1)]
+    w0, b0, w1, b1 = params
+    batch_size = min(batch_size, m)
+    # 缓冲区只分配一次：正向和反向传播、当前mini-batch的样本、优化器的状态
+    buf = alloc_buffers(batch_size, n, n_hidden, n_output, dtype)
+    batch_feature = np.empty((batch_size, n), dtype=dtype)
+    batch_label = np.empty((batch_size, n_output), dtype=dtype)
+    state = init_state(params, optimizer)
+
+    # 2、训练
+    t = 0
+    history = []
+    for epoch in range(n_epoch):
+        lr = learning_rate(alpha, epoch, n_epoch, schedule, decay, step_size)
+        order = rng.permutation(m)  # 每一轮打乱样本的顺序
+        for begin in range(0, m, batch_size):
+            idx = order[begin:begin + batch_size]
+            k = len(idx)
+            # 取出的样本直接写到缓冲区中
+            np.take(feature, idx, axis=0, out=batch_feature[:k])
+            np.take(label, idx, axis=0, out=batch_label[:k])
+            t += 1
+            train_step(batch_feature[:k], batch_label[:k], params, buf, state, optimizer, lr, t, momentum)
+        # 3、每一轮结束时评估
+        pre = get_predict(feature, w0, w1, b0, b1)
+        cost = (1.0 / 2) * get_cost(pre - label)
+        acc = float(np.mean(np.argmax(pre, axis=1) == np.argmax(label, axis=1)))
+        history.append((epoch + 1, time.time() - start, cost, acc))
+        if verbose:
+            print "\t-------- epoch: ", epoch + 1, " ,lr: ", lr, " ,cost: ", cost, " ,acc: ", acc
+        if target_acc is not None and acc >= target_acc:
+            break
+    return np.mat(w0), np.mat(w1), np.mat(b0), np.mat(b1), history
+
+
+if __name__ == "__main__":
+    # 1、导入数据
+    print "--------- 1.load data ------------"
+    feature, label, n_class = load_data("data.txt")
+    # 2、mini-batch训练网络模型
+    print "--------- 2.training ------------"
+    w0, w1, b0, b1, history = sgd_train(feature, label, 20, 100, 0.01, n_class, batch_size=32,
+                                        optimizer=ADAM, schedule=COSINE, seed=1)
+    # 3、保存最终的模型，与bp_train的模型格式相同
+    print "--------- 3.save model ------------"
+    save_model(w0, w1, b0, b1)
+    # 4、得到最终的预测结果
+    print "--------- 4.get prediction ------------"
+    print "训练准确性为：", accuracy(feature, label, w0, w1, b0, b1)
@@ -3,9 +3,15 @@
 Date:20160831
 @author: zhaozhiyong
 '''
+import os
+import sys
 import numpy as np
 from math import sqrt
 
+# 按块解析数据文件的模块与随机森林共用，在 randomForest 目录下
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'randomForest'))
+from data_loader import load_table
+
 def load_data(file_name):
     '''导入数据
     input:  file_name(string):文件的存储位置
@@ -13,28 +19,18 @@ def load_data(file_name):
             label_data(mat):标签
             n_class(int):类别的个数
     '''
-    # 1、获取特征
-    f = open(file_name)  # 打开文件
-    feature_data = []
-    label_tmp = []
-    for line in f.readlines():
-        feature_tmp = []
-        lines = line.strip().split("\t")
-        for i in xrange(len(lines) - 1):
-            feature_tmp.append(float(lines[i]))
-        label_tmp.append(int(lines[-1]))      
-        feature_data.append(feature_tmp)
-    f.close()  # 关闭文件
-    
+    # 1、获取特征，按块解析成一个矩阵，并缓存成.npy
+    data = load_table(file_name, "\t")
+    label_tmp = data[:, -1].astype(int)
+
     # 2、获取标签
     m = len(label_tmp)
-    n_class = len(set(label_tmp))  # 得到类别的个数
-    
+    n_class = len(np.unique(label_tmp))  # 得到类别的个数
+
     label_data = np.mat(np.zeros((m, n_class)))
-    for i in xrange(m):
-        label_data[i, label_tmp[i]] = 1
-    
-    return np.mat(feature_data), label_data, n_class
+    label_data[np.arange(m), label_tmp] = 1
+
+    return np.mat(data[:, :-1]), label_data, n_class
 
 def sig(x):
     '''Sigmoid函数
@@ -48,12 +44,29 @@ def partial_sig(x):
     input:  x(mat/float):自变量，可以是矩阵或者是任意实数
     output: out(mat/float):Sigmoid导函数的值
     '''
-    m, n = np.shape(x)
-    out = np.mat(np.zeros((m, n)))
-    for i in xrange(m):
-        for j in xrange(n):
-            out[i, j] = sig(x[i, j]) * (1 - sig(x[i, j]))
-    return out
+    s = sig(x)  # 每个元素只计算一次Sigmoid
+    return np.multiply(s, 1 - s)
+
+def sig_inplace(x):
+    '''原地计算Sigmoid，不分配新的内存
+    input:  x(array):自变量，计算后保存Sigmoid值
+    output: x(array):Sigmoid值
+    '''
+    np.negative(x, out=x)
+    np.exp(x, out=x)
+    x += 1
+    np.reciprocal(x, out=x)
+    return x
+
+def partial_sig_out(out, buf):
+    '''用已经计算好的Sigmoid值得到导函数的值：sig'(x) = sig(x) * (1 - sig(x))
+    input:  out(array):Sigmoid函数的值
+            buf(array):保存结果的缓冲区，与out的大小相同
+    output: buf(array):Sigmoid导函数的值
+    '''
+    np.subtract(1, out, out=buf)
+    buf *= out
+    return buf
 
 def hidden_in(feature, w0, b0):
     '''计算隐含层的输入
@@ -62,11 +75,7 @@ def hidden_in(feature, w0, b0):
             b0(mat):输入层到隐含层之间的偏置
     output: hidden_in(mat):隐含层的输入
     '''
-    m = np.shape(feature)[0]
-    hidden_in = feature * w0
-    for i in xrange(m):
-        hidden_in[i, ] += b0
-    return hidden_in
+    return np.dot(feature, w0) + b0  # 偏置按行广播
 
 def hidden_out(hidden_in):
     '''隐含层的输出
@@ -83,11 +92,7 @@ def predict_in(hidden_out, w1, b1):
             b1(mat):隐含层到输出层之间的偏置
     output: predict_in(mat):输出层的输入
     '''
-    m = np.shape(hidden_out)[0]
-    predict_in = hidden_out * w1
-    for i in xrange(m):
-        predict_in[i, ] += b1
-    return predict_in
+    return np.dot(hidden_out, w1) + b1  # 偏置按行广播
     
 def predict_out(predict_in):
     '''输出层的输出
@@ -97,7 +102,83 @@ def predict_out(predict_in):
     result = sig(predict_in)
     return result
 
-def bp_train(feature, label, n_hidden, maxCycle, alpha, n_output):
+def init_weights(n, n_hidden, n_output):
+    '''随机初始化权重和偏置
+    input:  n(int):输入层的节点个数(特征个数)
+            n_hidden(int):隐含层的节点个数
+            n_output(int):输出层的节点个数
+    output: w0, b0, w1, b1(mat):输入层到隐含层、隐含层到输出层之间的权重和偏置
+    '''
+    w0 = np.mat(np.random.rand(n, n_hidden))
+    w0 = w0 * (8.0 * sqrt(6) / sqrt(n + n_hidden)) - np.mat(np.ones((n, n_hidden))) * (4.0 * sqrt(6) / sqrt(n + n_hidden))
+    b0 = np.mat(np.random.rand(1, n_hidden))
+    b0 = b0 * (8.0 * sqrt(6) / sqrt(n + n_hidden)) - np.mat(np.ones((1, n_hidden))) * (4.0 * sqrt(6) / sqrt(n + n_hidden))
+    w1 = np.mat(np.random.rand(n_hidden, n_output))
+    w1 = w1 * (8.0 * sqrt(6) / sqrt(n_hidden + n_output)) - np.mat(np.ones((n_hidden, n_output))) * (4.0 * sqrt(6) / sqrt(n_hidden + n_output))
+    b1 = np.mat(np.random.rand(1, n_output))
+    b1 = b1 * (8.0 * sqrt(6) / sqrt(n_hidden + n_output)) -  np.mat(np.ones((1, n_output))) * (4.0 * sqrt(6) / sqrt(n_hidden + n_output))
+    return w0, b0, w1, b1
+
+def alloc_buffers(m, n, n_hidden, n_output, dtype=np.float64):
+    '''分配正向传播、反向传播和梯度的缓冲区，训练过程中只分配一次
+    input:  m(int):每次计算的最多样本个数
+            n(int):特征个数
+            n_hidden(int):隐含层的节点个数
+            n_output(int):输出层的节点个数
+            dtype:浮点类型
+    output: buf(dict):所有的缓冲区
+    '''
+    return {'hidden_output': np.empty((m, n_hidden), dtype=dtype),
+            'output_out': np.empty((m, n_output), dtype=dtype),
+            'delta_hidden': np.empty((m, n_hidden), dtype=dtype),
+            'delta_output': np.empty((m, n_output), dtype=dtype),
+            'buf_hidden': np.empty((m, n_hidden), dtype=dtype),
+            'buf_output': np.empty((m, n_output), dtype=dtype),
+            'grad_w0': np.empty((n, n_hidden), dtype=dtype),
+            'grad_w1': np.empty((n_hidden, n_output), dtype=dtype),
+            'grad_b0': np.empty((1, n_hidden), dtype=dtype),
+            'grad_b1': np.empty((1, n_output), dtype=dtype)}
+
+def compute_grad(feature, label, w0, b0, w1, b1, buf):
+    '''一次正向传播和反向传播，梯度保存在buf中(所有样本的和，没有除以样本个数)
+    input:  feature(array):特征，行数不超过缓冲区的大小
+            label(array):标签
+            w0, b0, w1, b1(array):权重和偏置
+            buf(dict):alloc_buffers分配的缓冲区
+    output: buf(dict):grad_w0/grad_b0/grad_w1/grad_b1为梯度，output_out为输出层的输出
+    '''
+    m = np.shape(feature)[0]
+    # 样本少于缓冲区的行数时(最后一个mini-batch)使用缓冲区的前m行，仍然是连续的内存
+    hidden_output, output_out = buf['hidden_output'][:m], buf['output_out'][:m]
+    delta_hidden, delta_output = buf['delta_hidden'][:m], buf['delta_output'][:m]
+    # 1、信号正向传播
+    # 1.1、计算隐含层的输入
+    np.dot(feature, w0, out=hidden_output)  # mXn_hidden
+    hidden_output += b0
+    # 1.2、计算隐含层的输出
+    sig_inplace(hidden_output)
+    # 1.3、计算输出层的输入
+    np.dot(hidden_output, w1, out=output_out)  # mXn_output
+    output_out += b1
+    # 1.4、计算输出层的输出
+    sig_inplace(output_out)
+
+    # 2、误差的反向传播，Sigmoid的导数直接用正向传播的输出计算
+    # 2.1、隐含层到输出层之间的残差
+    np.subtract(output_out, label, out=delta_output)
+    delta_output *= partial_sig_out(output_out, buf['buf_output'][:m])
+    # 2.2、输入层到隐含层之间的残差
+    np.dot(delta_output, w1.T, out=delta_hidden)
+    delta_hidden *= partial_sig_out(hidden_output, buf['buf_hidden'][:m])
+
+    # 3、梯度
+    np.dot(hidden_output.T, delta_output, out=buf['grad_w1'])
+    np.sum(delta_output, axis=0, out=buf['grad_b1'][0])
+    np.dot(feature.T, delta_hidden, out=buf['grad_w0'])
+    np.sum(delta_hidden, axis=0, out=buf['grad_b0'][0])
+    return buf
+
+def bp_train(feature, label, n_hidden, maxCycle, alpha, n_output, dtype=np.float64, target_acc=None):
     '''计算隐含层的输入
     input:  feature(mat):特征
             label(mat):标签
@@ -105,6 +186,8 @@ def bp_train(feature, label, n_hidden, maxCycle, alpha, n_output):
             maxCycle(int):最大的迭代次数
             alpha(float):学习率
             n_output(int):输出层的节点个数
+            dtype:训练时使用的浮点类型，np.float32可以减少一半的内存并加快矩阵乘法
+            target_acc(float):每10次迭代检查一次训练准确率，达到后提前停止，None表示不检查
     output: w0(mat):输入层到隐含层之间的权重
             b0(mat):输入层到隐含层之间的偏置
             w1(mat):隐含层到输出层之间的权重
@@ -112,57 +195,40 @@ def bp_train(feature, label, n_hidden, maxCycle, alpha, n_output):
     '''
     m, n = np.shape(feature)
     # 1、初始化
-    w0 = np.mat(np.random.rand(n, n_hidden))
-    w0 = w0 * (8.0 * sqrt(6) / sqrt(n + n_hidden)) - np.mat(np.ones((n, n_hidden))) * (4.0 * sqrt(6) / sqrt(n + n_hidden))
-    b0 = np.mat(np.random.rand(1, n_hidden))
-    b0 = b0 * (8.0 * sqrt(6) / sqrt(n + n_hidden)) - np.mat(np.ones((1, n_hidden))) * (4.0 * sqrt(6) / sqrt(n + n_hidden))
-    w1 = np.mat(np.random.rand(n_hidden, n_output))
-    w1 = w1 * (8.0 * sqrt(6) / sqrt(n_hidden + n_output)) - np.mat(np.ones((n_hidden, n_output))) * (4.0 * sqrt(6) / sqrt(n_hidden + n_output))
-    b1 = np.mat(np.random.rand(1, n_output))
-    b1 = b1 * (8.0 * sqrt(6) / sqrt(n_hidden + n_output)) -  np.mat(np.ones((1, n_output))) * (4.0 * sqrt(6) / sqrt(n_hidden + n_output))
-    
+    w0, b0, w1, b1 = init_weights(n, n_hidden, n_output)
+    # 训练时用普通的数组，所有的运算都是原地更新
+    feature, label = np.asarray(feature, dtype=dtype), np.asarray(label, dtype=dtype)
+    w0, b0, w1, b1 = [np.array(x, dtype=dtype) for x in (w0, b0, w1, b1)]
+    buf = alloc_buffers(m, n, n_hidden, n_output, dtype)  # 缓冲区只分配一次
+
     # 2、训练
     i = 0
     while i <= maxCycle:
-        # 2.1、信号正向传播
-        # 2.1.1、计算隐含层的输入
-        hidden_input = hidden_in(feature, w0, b0)  # mXn_hidden
-        # 2.1.2、计算隐含层的输出
-        hidden_output = hidden_out(hidden_input)
-        # 2.1.3、计算输出层的输入
-        output_in = predict_in(hidden_output, w1, b1)  # mXn_output
-        # 2.1.4、计算输出层的输出
-        output_out = predict_out(output_in)
-        
-        # 2.2、误差的反向传播
-        # 2.2.1、隐含层到输出层之间的残差
-        delta_output = -np.multiply((label - output_out), partial_sig(output_in))
-        # 2.2.2、输入层到隐含层之间的残差
-        delta_hidden = np.multiply((delta_output * w1.T), partial_sig(hidden_input))
-        
-        # 2.3、 修正权重和偏置       
-        w1 = w1 - alpha * (hidden_output.T * delta_output)
-        b1 = b1 - alpha * np.sum(delta_output, axis=0) * (1.0 / m)
-        w0 = w0 - alpha * (feature.T * delta_hidden)
-        b0 = b0 - alpha * np.sum(delta_hidden, axis=0) * (1.0 / m)
+        # 2.1、正向传播和误差的反向传播
+        compute_grad(feature, label, w0, b0, w1, b1, buf)
+        # 2.2、 修正权重和偏置
+        grad_w1, grad_w0 = buf['grad_w1'], buf['grad_w0']
+        grad_w1 *= alpha
+        w1 -= grad_w1
+        b1 -= (alpha / m) * buf['grad_b1']
+        grad_w0 *= alpha
+        w0 -= grad_w0
+        b0 -= (alpha / m) * buf['grad_b0']
         if i % 100 == 0:
             print "\t-------- iter: ", i, \
-            " ,cost: ",  (1.0/2) * get_cost(get_predict(feature, w0, w1, b0, b1) - label)                
-        i += 1           
-    return w0, w1, b0, b1
+            " ,cost: ",  (1.0/2) * get_cost(get_predict(feature, w0, w1, b0, b1) - label)
+        if target_acc is not None and i % 10 == 0 and accuracy(feature, label, w0, w1, b0, b1) >= target_acc:
+            break
+        i += 1
+    return np.mat(w0), np.mat(w1), np.mat(b0), np.mat(b1)
 
 def get_cost(cost):
     '''计算当前损失函数的值
     input:  cost(mat):预测值与标签之间的差
     output: cost_sum / m (double):损失函数的值
     '''
-    m,n = np.shape(cost)
-    
-    cost_sum = 0.0
-    for i in xrange(m):
-        for j in xrange(n):
-            cost_sum += cost[i,j] * cost[i,j]
-    return cost_sum / m
+    m = np.shape(cost)[0]
+    return float(np.sum(np.square(cost))) / m
 
 def get_predict(feature, w0, w1, b0, b1):
     '''计算最终的预测
@@ -198,19 +264,23 @@ def save_model(w0, w1, b0, b1):
     write_file("weight_b0", b0)
     write_file("weight_b1", b1)
     
+def accuracy(feature, label, w0, w1, b0, b1):
+    '''当前模型在样本上的准确率
+    input:  feature(mat):特征
+            label(mat):one-hot的标签
+            w0, w1, b0, b1(mat):权重和偏置
+    output: (float):准确率
+    '''
+    pre = get_predict(feature, w0, w1, b0, b1)
+    return float(np.mean(np.argmax(np.asarray(pre), axis=1) == np.argmax(np.asarray(label), axis=1)))
+
 def err_rate(label, pre):
     '''计算训练样本上的错误率
     input:  label(mat):训练样本的标签
             pre(mat):训练样本的预测值
     output: rate[0,0](float):错误率
     '''
-    m = np.shape(label)[0]
-    err = 0.0
-    for i in xrange(m):
-        if label[i, 0] != pre[i, 0]:
-            err += 1
-    rate = err / m
-    return rate
+    return float(np.mean(np.asarray(label)[:, 0] != np.asarray(pre)[:, 0]))
 
 if __name__ == "__main__":
     # 1、导入数据
@@ -0,0 +1,161 @@
+# coding:UTF-8
+'''
+梯度提升树(GBDT)：每一轮用train_cart的CART回归树拟合当前预测的负梯度(平方损失时就是残差)，
+预测值加上学习率乘以这棵树的预测。
+
+1、每一轮只用新的树更新训练集和验证集的预测值，不需要重新预测整个集成
+2、每一轮可以只抽取一部分样本建树(subsample)
+3、验证集的损失连续early_stopping_rounds轮没有下降时停止，只保留验证集上最好的轮数
+4、预测时所有的树编译成扁平数组，每一块样本只转置一次，所有的树共用
+
+对数损失时叶节点的值也是负梯度的平均值(一阶的梯度步)，不是常见的GBDT实现中的牛顿步
+sum(y - p) / sum(p * (1 - p))，收敛得更慢，需要更多的轮数或者更大的学习率。
+'''
+import numpy as np
+from train_cart import grow_tree, load_data
+from binning import bin_features
+from flat_tree import compile_tree, predict_tree, sum_predict_batch
+from model_store import save_flat, load_flat, BOOSTING
+
+SQUARED = 'squared'  # 平方损失，回归
+LOGISTIC = 'logistic'  # 对数损失，标签为0/1的二分类，预测值为概率
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def init_score(loss, y):
+    '''所有样本的初始预测值'''
+    if loss == LOGISTIC:
+        p = np.clip(np.mean(y), 1e-6, 1 - 1e-6)
+        return float(np.log(p / (1 - p)))
+    return float(np.mean(y))
+
+
+def negative_gradient(loss, y, score):
+    '''损失函数对预测值的负梯度，下一棵树的拟合目标'''
+    if loss == LOGISTIC:
+        return y - sigmoid(score)
+    return y - score
+
+
+def loss_value(loss, y, score):
+    '''平均损失'''
+    if loss == LOGISTIC:
+        return float(np.mean(np.logaddexp(0, score) - y * score))
+    return float(np.mean((y - score) ** 2))
+
+
+def train_gbdt(X, y, n_rounds=100, learning_rate=0.1, max_depth=3, min_sample=20, subsample=1.0,
+               X_val=None, y_val=None, early_stopping_rounds=None, loss=SQUARED, max_bins=None, seed=None):
+    '''训练梯度提升树
+    input:  X(array):训练数据的特征矩阵
+            y(array):标签，LOGISTIC时为0/1
+            n_rounds(int):最多的轮数(树的个数)
+            learning_rate(float):学习率(shrinkage)，每棵树的预测乘以它
+            max_depth(int):每棵树的最大深度
+            min_sample(int):叶子节点中最少的样本数
+            subsample(float):每一轮建树抽取的样本比例(不放回)
+            X_val, y_val(array):验证集，None表示不使用
+            early_stopping_rounds(int):验证集的损失连续这么多轮没有下降时停止，None表示不提前停止；
+                                       需要同时给出验证集，否则抛出ValueError
+            loss(string):SQUARED或者LOGISTIC，LOGISTIC的叶节点为负梯度的平均值，比牛顿步收敛得慢
+            max_bins(int):每个特征量化成的箱子个数(<=256)，None表示不量化
+            seed(int):抽样的随机种子
+    output: model(dict):base/learning_rate/loss/trees(编译后的树)/best_round/history
+    '''
+    if early_stopping_rounds is not None and (X_val is None or y_val is None):
+        raise ValueError('early_stopping_rounds needs a validation set (X_val and y_val)')
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    rng = np.random.RandomState(seed)
+    bins = bin_features(X, max_bins) if max_bins else None  # 特征只量化一次，所有的树共用
+    base = init_score(loss, y)
+    score = np.zeros(len(y)) + base
+    has_val = X_val is not None
+    if has_val:
+        X_val = np.asarray(X_val, dtype=np.float64)
+        y_val = np.asarray(y_val, dtype=np.float64)
+        score_val = np.zeros(len(y_val)) + base
+    n_sample = max(1, int(round(len(y) * subsample)))
+
+    trees = []
+    history = []
+    best_round, best_loss = 0, None
+    for i in range(n_rounds):
+        # 1、当前预测的负梯度作为这一轮的拟合目标
+        residual = negative_gradient(loss, y, score)
+        if subsample < 1.0:
+            idx = np.sort(rng.choice(len(y), n_sample, replace=False))
+        else:
+            idx = np.arange(len(y))
+        # 2、用CART回归树拟合负梯度，叶节点为样本负梯度的平均值
+        flat = compile_tree(grow_tree(X, residual, idx, min_sample, 0.0, max_depth, bins))
+        flat['value'] = flat['value'] * learning_rate  # 学习率直接乘到叶节点上
+        trees.append(flat)
+        # 3、只用新的树更新预测值
+        score += predict_tree(flat, X)
+        record = [loss_value(loss, y, score)]
+        if has_val:
+            score_val += predict_tree(flat, X_val)
+            record.append(loss_value(loss, y_val, score_val))
+        history.append(record)
+        # 4、提前停止
+        now_loss = record[-1]
+        if best_loss is None or now_loss < best_loss:
+            best_round, best_loss = i + 1, now_loss
+        elif early_stopping_rounds is not None and i + 1 - best_round >= early_stopping_rounds:
+            break
+    if early_stopping_rounds is not None:
+        trees = trees[:best_round]  # 只保留验证集上最好的轮数
+    return {'base': base, 'learning_rate': learning_rate, 'loss': loss,
+            'trees': trees, 'best_round': best_round, 'history': history}
+
+
+def predict_gbdt(model, X):
+    '''梯度提升树的批量预测
+    input:  model(dict):train_gbdt或者load_gbdt返回的模型
+            X(array):样本矩阵
+    output: prediction(array):SQUARED时为预测值，LOGISTIC时为类别1的概率
+    '''
+    score = model['base'] + sum_predict_batch(model['trees'], X)
+    if model['loss'] == LOGISTIC:
+        return sigmoid(score)
+    return score
+
+
+def save_gbdt(model, model_file):
+    '''保存成二进制模型文件，学习率已经乘到叶节点上'''
+    extra = {'base': model['base'], 'learning_rate': model['learning_rate'], 'loss': model['loss']}
+    save_flat(model_file, model['trees'], BOOSTING, extra=extra)
+
+
+def load_gbdt(model_file):
+    '''用mmap加载save_gbdt保存的模型'''
+    flat_trees, meta = load_flat(model_file)
+    if meta['kind'] != BOOSTING:
+        raise ValueError('%s is not a boosting model' % model_file)
+    model = dict(meta['extra'])
+    model['trees'] = flat_trees
+    return model
+
+
+if __name__ == "__main__":
+    # 1、导入数据，后四分之一作为验证集
+    print "----------- 1、load data -------------"
+    data = load_data("sine.txt")
+    data = data[np.random.RandomState(0).permutation(len(data))]
+    offset = len(data) * 3 // 4
+    X, y = data[:offset, :-1], data[:offset, -1]
+    X_val, y_val = data[offset:, :-1], data[offset:, -1]
+    # 2、训练梯度提升树
+    print "----------- 2、train GBDT ------------"
+    model = train_gbdt(X, y, n_rounds=500, learning_rate=0.1, max_depth=3, min_sample=5, subsample=0.8,
+                       X_val=X_val, y_val=y_val, early_stopping_rounds=20, seed=710)
+    print "\t--------- best round : ", model['best_round']
+    print "\t--------- train mse : ", model['history'][model['best_round'] - 1][0]
+    print "\t--------- val mse : ", model['history'][model['best_round'] - 1][1]
+    # 3、保存二进制的模型
+    print "----------- 3、save model -----------"
+    save_gbdt(model, "gbdt_model")
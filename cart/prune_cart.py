@@ -0,0 +1,197 @@
+# coding:UTF-8
+'''
+CART回归树的代价复杂度剪枝(minimal cost-complexity pruning)，用验证集选择剪枝的程度。
+
+子树T的代价为 R_alpha(T) = R(T) + alpha * |T|，R(T)为叶节点的训练总方差之和，|T|为叶节点个数。
+每次剪掉 g(t) = (R(t) - R(T_t)) / (|T_t| - 1) 最小的内部节点t(最弱的连接)，得到一串越来越小的子树。
+
+1、R(t)、样本个数和均值在建树时已经缓存在节点上(train_cart.grow_tree)，不需要再扫描训练数据
+2、验证集只推进一次：把每个叶节点上验证样本的个数、y的和、y的平方和累加到所有的祖先，
+   任何一个节点作为叶节点时的验证误差都可以直接算出，剪掉一个节点只需要更新它的祖先
+3、一遍得到所有alpha对应的叶节点个数和验证集的均方误差，选出满足误差要求的最小的树
+'''
+import numpy as np
+from train_cart import node, build_tree, load_data, cal_error
+from flat_tree import compile_tree, apply_tree
+from model_store import save_regression_tree
+
+
+def flatten(tree):
+    '''按先序(与flat_tree.compile_tree的节点顺序相同)取出所有节点和建树时缓存的统计量
+    input:  tree:train_cart.build_tree构建的CART回归树
+    output: nodes(list):所有的节点
+            left, right(array):左右子节点的下标，叶节点为-1
+            end(array):以该节点为根的子树在先序中的结束位置(不包含)
+    '''
+    nodes, left, right = [], [], []
+    stack = [(tree, -1, False)]
+    while stack:
+        sub_tree, parent, is_right = stack.pop()
+        if not hasattr(sub_tree, 'n_sample') or sub_tree.mean is None:
+            raise ValueError('the tree has no cached node statistics, rebuild it with train_cart.build_tree')
+        idx = len(nodes)
+        if parent >= 0:
+            if is_right:
+                right[parent] = idx
+            else:
+                left[parent] = idx
+        nodes.append(sub_tree)
+        left.append(-1)
+        right.append(-1)
+        if sub_tree.results is None:
+            stack.append((sub_tree.right, idx, True))
+            stack.append((sub_tree.left, idx, False))
+    left, right = np.array(left), np.array(right)
+    # 先序中子节点的下标都比父节点大，倒序扫描一遍就能得到子树的范围
+    end = np.arange(1, len(nodes) + 1)
+    for i in range(len(nodes) - 1, -1, -1):
+        if left[i] >= 0:
+            end[i] = end[right[i]]
+    return nodes, left, right, end
+
+
+def prune_path(tree, X_val, y_val):
+    '''一遍计算所有alpha对应的剪枝结果
+    input:  tree:train_cart.build_tree构建的CART回归树
+            X_val(array):验证集的特征矩阵
+            y_val(array):验证集的标签
+    output: path(list):[(alpha, 叶节点个数, 验证集的均方误差)]，第一项为不剪枝的树(alpha=0)，
+                       最后一项只剩根节点
+            prune_alpha(array):先序中每个节点变成叶节点时的alpha，原来的叶节点为0，没有被剪掉的为inf
+    '''
+    nodes, left, right, end = flatten(tree)
+    n_node = len(nodes)
+    is_leaf = left < 0
+    parent = np.full(n_node, -1)
+    parent[left[~is_leaf]] = np.flatnonzero(~is_leaf)
+    parent[right[~is_leaf]] = np.flatnonzero(~is_leaf)
+
+    # 1、每个节点作为叶节点时的训练总方差和预测值
+    R = np.array([t.err for t in nodes])
+    mean = np.array([t.mean for t in nodes])
+
+    # 2、验证集推进到叶节点，按叶节点累加个数、y的和、y的平方和，再累加到所有的祖先
+    y_val = np.asarray(y_val, dtype=np.float64)
+    leaf_idx = apply_tree(compile_tree(tree), X_val)
+    cnt = np.bincount(leaf_idx, minlength=n_node).astype(np.float64)
+    s_1 = np.bincount(leaf_idx, weights=y_val, minlength=n_node)
+    s_2 = np.bincount(leaf_idx, weights=y_val * y_val, minlength=n_node)
+    for i in range(n_node - 1, 0, -1):
+        cnt[parent[i]] += cnt[i]
+        s_1[parent[i]] += s_1[i]
+        s_2[parent[i]] += s_2[i]
+    V = s_2 - 2 * mean * s_1 + cnt * mean * mean  # 节点作为叶节点时验证集的总方差
+
+    # 3、当前子树的叶节点个数、训练总方差之和、验证集总方差之和
+    n_leaf = np.where(is_leaf, 1.0, 0.0)  # 内部节点只累加叶节点的个数
+    R_sub = np.where(is_leaf, R, 0.0)
+    V_sub = np.where(is_leaf, V, 0.0)
+    for i in range(n_node - 1, 0, -1):
+        n_leaf[parent[i]] += n_leaf[i]
+        R_sub[parent[i]] += R_sub[i]
+        V_sub[parent[i]] += V_sub[i]
+
+    # 4、每次剪掉g(t)最小的内部节点
+    n_val = max(len(y_val), 1)
+    prune_alpha = np.where(is_leaf, 0.0, np.inf)
+    internal = ~is_leaf
+    path = [(0.0, int(n_leaf[0]), V_sub[0] / n_val)]
+    alpha = 0.0
+    while internal[0]:
+        inner = np.flatnonzero(internal)
+        g = (R[inner] - R_sub[inner]) / (n_leaf[inner] - 1)
+        g_min = g.min()
+        alpha = max(alpha, g_min)  # 数值误差不能让alpha变小
+        # g相同的节点一起剪掉，从先序靠前的(祖先)开始，已经被祖先剪掉的跳过
+        for t in inner[g <= g_min + 1e-12 * max(abs(g_min), 1.0)]:
+            if not internal[t]:
+                continue
+            d_leaf, d_R, d_V = n_leaf[t] - 1, R_sub[t] - R[t], V_sub[t] - V[t]
+            internal[t:end[t]] = False
+            prune_alpha[t] = alpha
+            n_leaf[t], R_sub[t], V_sub[t] = 1, R[t], V[t]
+            p = parent[t]
+            while p >= 0:
+                n_leaf[p] -= d_leaf
+                R_sub[p] -= d_R
+                V_sub[p] -= d_V
+                p = parent[p]
+        path.append((alpha, int(n_leaf[0]), V_sub[0] / n_val))
+    return path, prune_alpha
+
+
+def prune_tree(tree, prune_alpha, alpha):
+    '''按alpha剪枝，返回新的树，原来的树不变
+    input:  tree:train_cart.build_tree构建的CART回归树
+            prune_alpha(array):prune_path返回的每个节点变成叶节点时的alpha
+            alpha(float):复杂度参数
+    output: new_tree:剪枝后的CART回归树
+    '''
+    nodes, left, right, end = flatten(tree)
+    new_tree = node()
+    stack = [(0, new_tree)]
+    while stack:
+        i, new_node = stack.pop()
+        sub_tree = nodes[i]
+        new_node.n_sample, new_node.mean, new_node.err = sub_tree.n_sample, sub_tree.mean, sub_tree.err
+        if left[i] >= 0 and prune_alpha[i] > alpha:
+            new_node.fea, new_node.value = sub_tree.fea, sub_tree.value
+            new_node.right, new_node.left = node(), node()
+            stack.append((right[i], new_node.right))
+            stack.append((left[i], new_node.left))
+        else:
+            new_node.results = sub_tree.mean  # 剪掉的子树用建树时缓存的均值作为预测值
+    return new_tree
+
+
+def choose_alpha(path, max_err=None):
+    '''选出满足验证集误差要求的叶节点最少的树
+    input:  path(list):prune_path返回的剪枝路径
+            max_err(float):验证集均方误差的上限，None表示选择验证集误差最小的树
+    output: (alpha, n_leaf, val_err)(tuple):选中的一项，没有满足要求的树时返回误差最小的一项
+    '''
+    best = min(path, key=lambda p: (p[2], p[1]))
+    if max_err is None or best[2] > max_err:
+        return best
+    return min([p for p in path if p[2] <= max_err], key=lambda p: p[1])
+
+
+def cost_complexity_prune(tree, X_val, y_val, max_err=None):
+    '''用验证集对CART回归树剪枝
+    input:  tree:train_cart.build_tree构建的CART回归树
+            X_val(array):验证集的特征矩阵
+            y_val(array):验证集的标签
+            max_err(float):验证集均方误差的上限，None表示选择验证集误差最小的树
+    output: new_tree:剪枝后的CART回归树
+            path(list):所有alpha对应的叶节点个数和验证集的均方误差
+    '''
+    path, prune_alpha = prune_path(tree, X_val, y_val)
+    alpha = choose_alpha(path, max_err)[0]
+    return prune_tree(tree, prune_alpha, alpha), path
+
+
+if __name__ == "__main__":
+    # 1、导入数据，后四分之一作为验证集
+    print "----------- 1、load data -------------"
+    data = load_data("sine.txt")
+    data = data[np.random.RandomState(0).permutation(len(data))]
+    offset = len(data) * 3 // 4
+    data_train, data_val = data[:offset], data[offset:]
+    # 2、构建完整的CART树
+    print "----------- 2、build CART ------------"
+    regression_tree = build_tree(data_train, 3, 0.0)
+    # 3、一遍得到所有alpha对应的树的大小和验证集误差
+    print "----------- 3、prune path ------------"
+    path, prune_alpha = prune_path(regression_tree, data_val[:, :-1], data_val[:, -1])
+    for alpha, n_leaf, val_err in path:
+        print "\talpha : %.6f\tleaves : %d\tval mse : %.6f" % (alpha, n_leaf, val_err)
+    # 4、验证集误差不超过最小误差的1.05倍时，选择叶节点最少的树
+    print "----------- 4、prune CART ------------"
+    max_err = min(p[2] for p in path) * 1.05
+    alpha, n_leaf, val_err = choose_alpha(path, max_err)
+    pruned_tree = prune_tree(regression_tree, prune_alpha, alpha)
+    print "\t--------- alpha : ", alpha, " leaves : ", n_leaf
+    print "\t--------- val err : ", cal_error(data_val, pruned_tree)
+    # 5、保存二进制的模型
+    print "----------- 5、save result -----------"
+    save_regression_tree(pruned_tree, "regression_tree.bin")
@@ -6,7 +6,8 @@ Date:20161030
 
 import random as rd
 import cPickle as pickle
-from train_cart import predict,node
+from train_cart import predict_batch,node
+from model_store import load_flat, REGRESSION
 
 def load_data():
     '''导入测试数据集
@@ -27,16 +28,23 @@ def load_model(tree_file):
         regression_tree = pickle.load(f)
     return regression_tree    
 
+def load_model_binary(model_file):
+    '''导入二进制的CART回归树模型，节点数组直接映射文件，不生成node对象
+    input:  model_file(string):保存CART回归树模型的文件
+    output: flat(dict):编译后的CART回归树
+    '''
+    flat_trees, meta = load_flat(model_file)
+    if meta['kind'] != REGRESSION:
+        raise ValueError('%s is not a regression tree model' % model_file)
+    return flat_trees[0]
+
 def get_prediction(data_test, regression_tree):
     '''对测试样本进行预测
     input:  data_test(list):需要预测的样本
-            regression_tree(regression_tree):训练好的回归树模型
-    output: result(list):
+            regression_tree(regression_tree):训练好的回归树模型，或者load_model_binary导入的编译好的树
+    output: result(array):每个样本的预测值
     '''
-    result = []
-    for x in data_test:
-        result.append(predict(x, regression_tree))
-    return result
+    return predict_batch(data_test, regression_tree)
 
 def save_result(data_test, result, prediction_file):
     '''保存最终的预测结果
@@ -56,10 +64,10 @@ if __name__ == "__main__":
     data_test = load_data()
     # 2、导入回归树模型
     print "--------- 2、load regression tree ---------"
-    regression_tree = load_model("regression_tree")
+    flat = load_model_binary("regression_tree.bin")
     # 3、进行预测
     print "--------- 3、get prediction -----------"
-    prediction = get_prediction(data_test, regression_tree)
+    prediction = get_prediction(data_test, flat)
     # 4、保存预测的结果
     print "--------- 4、save result ----------"
     save_result(data_test, prediction, "prediction")
@@ -0,0 +1,68 @@
+# coding:UTF-8
+'''
+prune_cart的测试：剪枝路径上每一项的叶节点个数和alpha与按该alpha实际剪出的树一致
+
+    python -m unittest test_prune_cart
+'''
+import unittest
+import numpy as np
+from train_cart import build_tree
+from flat_tree import compile_tree, predict_tree
+from prune_cart import prune_path, prune_tree
+
+
+def count_leaves(tree):
+    return int(np.sum(compile_tree(tree)['feature'] < 0))
+
+
+def subtree_stats(tree):
+    '''暴力计算每个内部节点的 R(t)、R(T_t) 和叶节点个数，返回最弱连接的 g(t)'''
+    g_min = np.inf
+    stack = [tree]
+    while stack:
+        t = stack.pop()
+        if t.results is not None:
+            continue
+        leaves, r_sub = 0, 0.0
+        sub = [t]
+        while sub:
+            s = sub.pop()
+            if s.results is not None:
+                leaves += 1
+                r_sub += s.err
+            else:
+                sub.extend([s.left, s.right])
+        g_min = min(g_min, (t.err - r_sub) / (leaves - 1))
+        stack.extend([t.left, t.right])
+    return g_min
+
+
+class PrunePathTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        X = rng.rand(600, 2)
+        y = np.sin(6 * X[:, 0]) + X[:, 1] + 0.3 * rng.randn(600)
+        self.tree = build_tree(np.column_stack((X[:400], y[:400])), 3, 0.0)
+        self.X_val, self.y_val = X[400:], y[400:]
+
+    def test_path_matches_pruned_trees(self):
+        path, prune_alpha = prune_path(self.tree, self.X_val, self.y_val)
+        self.assertEqual(path[0][1], count_leaves(self.tree))
+        self.assertEqual(path[-1][1], 1)
+        prev = self.tree
+        for k, (alpha, n_leaf, val_err) in enumerate(path):
+            pruned = prune_tree(self.tree, prune_alpha, alpha)
+            # 叶节点个数与实际剪出的树相同
+            self.assertEqual(n_leaf, count_leaves(pruned))
+            # 验证集误差与实际剪出的树相同
+            pre = predict_tree(compile_tree(pruned), self.X_val)
+            self.assertAlmostEqual(val_err, np.mean((pre - self.y_val) ** 2))
+            # alpha是上一棵树中最弱连接的g(t)
+            if k > 0:
+                self.assertAlmostEqual(alpha, max(subtree_stats(prev), path[k - 1][0]), places=9)
+            prev = pruned
+
+
+if __name__ == '__main__':
+    unittest.main()
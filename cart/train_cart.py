@@ -3,9 +3,18 @@
 Date:20161030
 @author: zhaozhiyong
 '''
+import os
+import sys
 import numpy as np
 import cPickle as pickle
 
+# 编译树、二进制模型文件等与随机森林共用的模块在 randomForest 目录下
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'randomForest'))
+from model_store import save_regression_tree
+from flat_tree import compile_tree, predict_tree
+from binning import bin_features, n_bins, regression_histogram, child_histograms
+from data_loader import load_table
+
 
 class node:
     '''树的节点的类
@@ -17,24 +26,17 @@ class node:
         self.results = results  # 存储叶节点的值
         self.right = right  # 右子树
         self.left = left  # 左子树
+        self.n_sample = 0  # 建树时落入该节点的训练样本个数
+        self.mean = None  # 这些样本标签的均值，剪枝成叶节点时的预测值
+        self.err = 0.0  # 这些样本的总方差，剪枝时使用
 
 
 def load_data(data_file):
     '''导入训练数据
     input:  data_file(string):保存训练数据的文件
-    output: data(list):训练数据
+    output: data(array):训练数据，每一行是一个样本，最后一列是标签
     '''
-    data = []
-    f = open(data_file)
-    for line in f.readlines():
-        sample = []
-        lines = line.strip().split("\t")
-        for x in lines:
-            sample.append(float(x))  # 转换成float格式
-        data.append(sample)
-    f.close()
-
-    return data
+    return load_table(data_file, "\t")  # 按块解析成一个矩阵，并缓存成.npy
 
 
 def split_tree(data, fea, value):
@@ -74,50 +76,160 @@ def err_cnt(dataSet):
     return varValue * allLen
 
 
-def build_tree(data, min_sample, min_err):
+def choose_split(X, y, sub):
+    '''在sub这些样本上找出总方差最小的划分，每个特征只排序一次，
+    用y和y的平方的累计和一遍算出所有切分值的总方差
+    input:  X(array):特征矩阵
+            y(array):标签
+            sub(array):当前节点的样本在X中的下标
+    output: (best_err, fea, value)(tuple):划分后的总方差，划分的特征和值，
+            没有可以降低总方差的划分时fea为None
+    '''
+    n = len(sub)
+    y_sub = y[sub]
+    y_sub = y_sub - y_sub.sum() / n  # 减去均值不改变总方差，累计和的数值误差更小
+    best_err = y_sub.dot(y_sub)  # 不划分时的总方差
+    best_fea, best_value = None, None
+    for fea in range(X.shape[1]):
+        # 1、按特征值排序，累计y和y的平方
+        values = X[sub, fea]
+        order = values.argsort(kind='mergesort')
+        values = values[order]
+        y_order = y_sub[order]
+        s_1 = y_order.cumsum()
+        s_2 = (y_order * y_order).cumsum()
+        # 2、每个不同的取值作为切分值，小于它的n_l个样本为左子树，左右子树至少2个样本
+        n_l = np.flatnonzero(values[2:n - 1] != values[1:n - 2]) + 2
+        if len(n_l) == 0:
+            continue
+        # 3、总方差 = y的平方和 - y的和的平方 / 样本个数
+        left_1, left_2 = s_1[n_l - 1], s_2[n_l - 1]
+        now_err = (left_2 - left_1 * left_1 / n_l) + ((s_2[-1] - left_2) - (s_1[-1] - left_1) ** 2 / (n - n_l))
+        i = now_err.argmin()
+        # 4、更新最优划分
+        if now_err[i] < best_err:
+            best_err, best_fea, best_value = now_err[i], fea, float(values[n_l[i]])
+    return best_err, best_fea, best_value
+
+
+def choose_split_hist(hist, cuts, best_err):
+    '''在节点的直方图上找出总方差最小的划分，每个特征只扫描一遍箱子
+    input:  hist(array):节点的直方图，hist[0/1/2, fea, b]为第fea个特征落在第b个箱子的
+                        样本个数、y的和、y的平方和
+            cuts(list):每个特征的箱子切分点
+            best_err(float):不划分时的总方差
+    output: (best_err, fea, t)(tuple):划分后的总方差，划分的特征和箱子，
+            X_binned[:, fea] < t的样本分到左子树，没有可以降低总方差的划分时fea为None
+    '''
+    best_fea, best_bin = None, None
+    cnt, s_1, s_2 = hist[0][0].sum(), hist[1][0].sum(), hist[2][0].sum()
+    for fea in range(hist.shape[1]):
+        n_cut = len(cuts[fea])
+        if n_cut == 0:
+            continue
+        # 1、前t个箱子的累计和就是左子树的统计量，右子树用节点的总和减去左子树
+        left = np.cumsum(hist[:, fea, :n_cut], axis=1)
+        n_l, n_r = left[0], cnt - left[0]
+        valid = (n_l >= 2) & (n_r >= 2)
+        if not valid.any():
+            continue
+        n_l, n_r = np.where(valid, n_l, 1), np.where(valid, n_r, 1)
+        # 2、总方差 = y的平方和 - y的和的平方 / 样本个数
+        now_err = (left[2] - left[1] ** 2 / n_l) + ((s_2 - left[2]) - (s_1 - left[1]) ** 2 / n_r)
+        now_err[~valid] = np.inf
+        t = np.argmin(now_err)
+        if now_err[t] < best_err:
+            best_err, best_fea, best_bin = now_err[t], fea, t + 1
+    return best_err, best_fea, best_bin
+
+
+def partition(X, idx, start, end, fea, value):
+    '''把idx[start:end]原地划分成左右子树，X[:, fea] < value的样本下标在前
+    input:  X(array):特征矩阵
+            idx(array):样本下标
+            start, end(int):当前节点在idx中的范围
+            fea(int):划分的特征
+            value(float):划分的值
+    output: mid(int):左右子树的分界位置
+    '''
+    sub = idx[start:end]
+    mask = X[sub, fea] < value
+    idx[start:end] = np.concatenate((sub[mask], sub[~mask]))
+    return start + np.count_nonzero(mask)
+
+
+def grow_tree(X, y, idx, min_sample, min_err, max_depth=None, bins=None):
+    '''在共享的特征矩阵上构建树
+    input:  X(array):特征矩阵
+            y(array):标签
+            idx(array):参与建树的样本在X中的下标，会被原地重新排列
+            min_sample(int):叶子节点中最少的样本数
+            min_err(float):最小的error
+            max_depth(int):树的最大深度，None表示不限制
+            bins(tuple):(X_binned, cuts)，binning.bin_features的返回值，不为None时用直方图找划分
+    output: node:树的根结点
+    '''
+    # 所有节点共用一个特征矩阵，每个节点只对应idx中的一段，划分时原地重排idx
+    hist = None
+    if bins is not None:
+        # 每个节点按箱子累计样本个数、y的和、y的平方和
+        X_binned, cuts = bins
+        size = n_bins(cuts)
+        build_hist = lambda sub: regression_histogram(X_binned, y, sub, size)
+        hist = build_hist(idx)
+    root = node()
+    stack = [(root, 0, len(idx), 0, hist)]  # 用栈代替递归，树再深也不会超过递归的层数限制
+    while stack:
+        tree, start, end, depth, hist = stack.pop()
+        sub = idx[start:end]
+        # 缓存节点的统计量，剪枝时不需要再扫描训练数据
+        y_sub = y[sub]
+        tree.n_sample, tree.mean = len(sub), float(np.mean(y_sub))
+        tree.err = float(np.sum((y_sub - tree.mean) ** 2))
+        if len(sub) <= min_sample or (max_depth is not None and depth >= max_depth):
+            tree.results = tree.mean
+            continue
+
+        # 1、开始构建CART回归树，找到最好的划分
+        if hist is None:
+            best_err, fea, value = choose_split(X, y, sub)
+        else:
+            best_err, fea, t = choose_split_hist(hist, cuts, tree.err)
+            if fea is not None:
+                value = float(cuts[fea][t - 1])
+
+        # 2、判断划分是否结束
+        if best_err > min_err and fea is not None:
+            tree.fea, tree.value = fea, value
+            tree.right, tree.left = node(), node()
+            if hist is None:
+                mid = partition(X, idx, start, end, fea, value)
+                stack.append((tree.right, mid, end, depth + 1, None))
+                stack.append((tree.left, start, mid, depth + 1, None))
+            else:
+                mid = partition(X_binned, idx, start, end, fea, t)
+                # 只统计样本少的子树的直方图，另一个用父节点的直方图减去它
+                left_hist, right_hist = child_histograms(build_hist, hist, idx[start:mid], idx[mid:end])
+                stack.append((tree.right, mid, end, depth + 1, right_hist))
+                stack.append((tree.left, start, mid, depth + 1, left_hist))
+        else:
+            tree.results = tree.mean  # 返回当前的类别标签作为最终的类别标签
+    return root
+
+
+def build_tree(data, min_sample, min_err, max_bins=None, max_depth=None):
     '''构建树
     input:  data(list):训练样本
             min_sample(int):叶子节点中最少的样本数
             min_err(float):最小的error
+            max_bins(int):每个特征量化成的箱子个数(<=256)，None表示不量化
+            max_depth(int):树的最大深度，None表示不限制
     output: node:树的根结点
     '''
-    # 构建决策树，函数返回该决策树的根节点
-    if len(data) <= min_sample:
-        return node(results=leaf(data))
-
-    # 1、初始化
-    best_err = err_cnt(data)
-    bestCriteria = None  # 存储最佳切分属性以及最佳切分点
-    bestSets = None  # 存储切分后的两个数据集
-
-    # 2、开始构建CART回归树
-    feature_num = len(data[0]) - 1
-    for fea in range(0, feature_num):
-        feature_values = {}
-        for sample in data:
-            feature_values[sample[fea]] = 1
-
-        for value in feature_values.keys():
-            # 2.1、尝试划分
-            (set_1, set_2) = split_tree(data, fea, value)
-            if len(set_1) < 2 or len(set_2) < 2:
-                continue
-            # 2.2、计算划分后的error值
-            now_err = err_cnt(set_1) + err_cnt(set_2)
-            # 2.3、更新最优划分
-            if now_err < best_err and len(set_1) > 0 and len(set_2) > 0:
-                best_err = now_err
-                bestCriteria = (fea, value)
-                bestSets = (set_1, set_2)
-
-    # 3、判断划分是否结束
-    if best_err > min_err:
-        right = build_tree(bestSets[0], min_sample, min_err)
-        left = build_tree(bestSets[1], min_sample, min_err)
-        return node(fea=bestCriteria[0], value=bestCriteria[1], \
-                    right=right, left=left)
-    else:
-        return node(results=leaf(data))  # 返回当前的类别标签作为最终的类别标签
+    data = np.array(data, dtype=np.float64)
+    X, y = data[:, :-1], data[:, -1]
+    bins = bin_features(X, max_bins) if max_bins else None  # 特征只量化一次
+    return grow_tree(X, y, np.arange(len(y)), min_sample, min_err, max_depth, bins)
 
 
 def predict(sample, tree):
@@ -142,23 +254,25 @@ def predict(sample, tree):
         return predict(sample, branch)
 
 
+def predict_batch(matrix, tree):
+    '''对所有样本一起预测，树编译成扁平的节点数组，所有样本按层同时推进到叶节点
+    input:  matrix(list/array):样本矩阵，每一行是一个样本
+            tree:训练好的CART回归树模型，或者已经编译好的树(flat_tree.compile_tree)
+    output: results(array):每个样本的预测值
+    '''
+    flat = tree if isinstance(tree, dict) else compile_tree(tree)
+    return predict_tree(flat, np.asarray(matrix, dtype=np.float64))
+
+
 def cal_error(data, tree):
     ''' 评估CART回归树模型
-    input:  data(list):
+    input:  data(list/array):样本，最后一列是标签
             tree:训练好的CART回归树模型
     output: err/m(float):均方误差
     '''
-    m = len(data)  # 样本的个数   
-    n = len(data[0]) - 1  # 样本中特征的个数
-    err = 0.0
-    for i in xrange(m):
-        tmp = []
-        for j in xrange(n):
-            tmp.append(data[i][j])
-        pre = predict(tmp, tree)  # 对样本计算其预测值
-        # 计算残差
-        err += (data[i][-1] - pre) * (data[i][-1] - pre)
-    return err / m
+    data = np.asarray(data, dtype=np.float64)
+    residual = data[:, -1] - predict_batch(data[:, :-1], tree)  # 计算残差
+    return float(np.mean(residual * residual))
 
 
 def save_model(regression_tree, result_file):
@@ -184,3 +298,5 @@ if __name__ == "__main__":
     # 4、保存最终的CART模型
     print "----------- 4、save result -----------"
     save_model(regression_tree, "regression_tree")
+    # 5、保存二进制的模型，预测时用mmap直接加载
+    save_regression_tree(regression_tree, "regression_tree.bin")
@@ -0,0 +1,98 @@
+# coding:UTF-8
+'''
+批量打分：加载一次二进制模型(随机森林、CART回归树或者梯度提升树)，按块读入任意大小的数据文件，
+每一块用批量预测打分后立即写出，占用的内存只和块的大小有关，最后报告每秒处理的行数。
+
+用法:
+    python batch_score.py forest_model test_data.txt final_result
+    python batch_score.py ../cart/regression_tree.bin data.txt prediction --chunk-rows 100000
+    python batch_score.py forest_model data10.txt - --label     # 输入的最后一列是标签，结果写到标准输出
+'''
+import sys
+import time
+import argparse
+import numpy as np
+from flat_tree import predict_tree, bagging_predict_batch, sum_predict_batch, required_features, check_features
+from model_store import load_flat, CLASSIFY, BOOSTING
+from data_loader import iter_chunks
+
+CHUNK_ROWS = 65536  # 默认每一块的行数
+
+
+def score_chunk(flat_trees, meta, X):
+    '''对一块样本打分
+    input:  flat_trees(list):编译后的树
+            meta(dict):模型信息
+            X(array):样本矩阵
+    output: prediction(array):随机森林为得票最多的类别，回归树为所有树预测值的平均，
+            梯度提升树为初始值加上所有树的预测值(对数损失时为概率)
+    '''
+    if meta['kind'] == CLASSIFY:
+        return bagging_predict_batch(flat_trees, meta['classes'], X)
+    if meta['kind'] == BOOSTING:
+        score = meta['extra']['base'] + sum_predict_batch(flat_trees, X)
+        if meta['extra']['loss'] == 'logistic':
+            return 1.0 / (1.0 + np.exp(-score))
+        return score
+    prediction = np.zeros(X.shape[0])
+    for flat in flat_trees:
+        prediction += predict_tree(flat, X)
+    return prediction / len(flat_trees)
+
+
+def format_prediction(p):
+    '''预测值转换成字符串，浮点数用repr保留全部精度(Python 2的str只保留12位有效数字)'''
+    if isinstance(p, float):
+        return repr(p)
+    return str(p)
+
+
+def score_file(model_file, input_file, output, chunk_rows=CHUNK_ROWS, delimiter=None, has_label=False):
+    '''按块对整个文件打分，每一行输出一个预测值
+    input:  model_file(string):save_forest、save_regression_tree或者save_gbdt保存的模型文件
+            input_file(string):待预测的数据文件
+            output(file):写出预测结果的文件对象
+            chunk_rows(int):每一块的行数
+            delimiter(string):分隔符，None表示自动判断逗号或者空白
+            has_label(bool):输入的最后一列是否为标签，为True时不参与预测
+    output: (rows, seconds)(tuple):处理的行数和用时
+    数据的列数少于模型用到的特征个数时抛出 ValueError
+    '''
+    start = time.time()
+    flat_trees, meta = load_flat(model_file)  # 只加载一次，所有的块共用
+    n_required = required_features(flat_trees)
+    rows = 0
+    for X in iter_chunks(input_file, delimiter, np.float64, chunk_rows):
+        if has_label:
+            X = X[:, :-1]
+        check_features(n_required, X)  # 列数不够时在打分之前报错，已经写出的块不受影响
+        prediction = score_chunk(flat_trees, meta, X)
+        output.write('\n'.join([format_prediction(p) for p in prediction.tolist()]) + '\n')
+        rows += X.shape[0]
+    output.flush()
+    return rows, time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='streaming batch scoring for random forest / CART / GBDT models')
+    parser.add_argument('model_file', help='binary model file written by model_store')
+    parser.add_argument('input_file', help='delimited numeric data file')
+    parser.add_argument('output_file', help="prediction file, '-' for stdout")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='rows scored per chunk')
+    parser.add_argument('--delimiter', default=None, help='field delimiter, default: comma or whitespace')
+    parser.add_argument('--label', action='store_true', help='the last column of the input is a label')
+    args = parser.parse_args(argv)
+
+    if args.output_file == '-':
+        rows, seconds = score_file(args.model_file, args.input_file, sys.stdout,
+                                   args.chunk_rows, args.delimiter, args.label)
+    else:
+        with open(args.output_file, 'w') as output:
+            rows, seconds = score_file(args.model_file, args.input_file, output,
+                                       args.chunk_rows, args.delimiter, args.label)
+    # 吞吐量写到标准错误，不影响写到标准输出的预测结果
+    sys.stderr.write('scored %d rows in %.3fs (%.0f rows/sec)\n' % (rows, seconds, rows / max(seconds, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
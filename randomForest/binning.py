@@ -0,0 +1,99 @@
+# coding:UTF-8
+'''
+直方图切分：每个特征只在加载数据时量化一次，变成不超过256个箱子的uint8矩阵，
+节点上累计每个箱子的类别个数(分类)或者样本个数、y的和、y的平方和(回归)来找最优的切分，
+子节点的直方图等于父节点的直方图减去兄弟节点的直方图。
+
+第j个特征的箱子由切分点cuts[j]决定：x落在第searchsorted(cuts[j], x, 'right')个箱子，
+所以 箱子 < t 等价于 x < cuts[j][t - 1]，树中保存的仍然是原始的特征值，预测时不需要量化。
+'''
+import numpy as np
+
+MAX_BINS = 256
+
+
+def bin_features(X, max_bins=MAX_BINS):
+    '''把每个特征量化成不超过max_bins个箱子
+    input:  X(array):特征矩阵，需要整个放在内存中(不是float64时会先复制成float64)，
+                     量化后只保留uint8的X_binned，调用者可以释放原来的矩阵
+            max_bins(int):箱子的最大个数，不超过256
+    output: X_binned(array):uint8的矩阵，每个元素是样本所在的箱子
+            cuts(list):cuts[j]为第j个特征的切分点，都是特征中出现过的值
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    max_bins = min(max_bins, MAX_BINS)
+    X_binned = np.zeros(X.shape, dtype=np.uint8)
+    cuts = []
+    for j in range(X.shape[1]):
+        values = np.unique(X[:, j])
+        if len(values) > max_bins:
+            # 按分位数选择max_bins-1个切分点，每个箱子的样本数大致相同
+            column = np.sort(X[:, j])
+            cut = np.unique(column[(np.arange(1, max_bins) * len(column)) // max_bins])
+            cut = cut[cut > values[0]]  # 最小值较多时分位数可能等于最小值，左边为空，不需要
+        else:
+            cut = values[1:]  # 每个取值一个箱子，最小的值作为切分点时左边为空，不需要
+        X_binned[:, j] = np.searchsorted(cut, X[:, j], side='right')
+        cuts.append(cut)
+    return X_binned, cuts
+
+
+def n_bins(cuts):
+    '''所有特征中箱子的最大个数'''
+    return max([len(cut) for cut in cuts] + [0]) + 1
+
+
+def class_histogram(X_binned, y, weights, sub, bins, n_class):
+    '''统计sub这些样本在每个特征的每个箱子中各类别的权重之和
+    input:  X_binned(array):量化后的特征矩阵
+            y(array):类别标签的下标
+            weights(array):每个样本的权重
+            sub(array):样本的下标
+            bins(int):箱子的个数
+            n_class(int):类别的个数
+    output: hist(array):特征数*箱子数*类别数
+    '''
+    n_fea = X_binned.shape[1]
+    size = bins * n_class
+    y_sub, w_sub = y[sub], weights[sub]
+    hist = np.empty((n_fea, size))
+    # 每次只统计一个特征，临时数组的大小只和样本数有关
+    for j in range(n_fea):
+        codes = X_binned[sub, j].astype(np.intp) * n_class + y_sub
+        hist[j] = np.bincount(codes, weights=w_sub, minlength=size)
+    return hist.reshape(n_fea, bins, n_class)
+
+
+def regression_histogram(X_binned, y, sub, bins):
+    '''统计sub这些样本在每个特征的每个箱子中的样本个数、y的和、y的平方和
+    input:  X_binned(array):量化后的特征矩阵
+            y(array):标签
+            sub(array):样本的下标
+            bins(int):箱子的个数
+    output: hist(array):3*特征数*箱子数
+    '''
+    n_fea = X_binned.shape[1]
+    y_sub = y[sub]
+    y_sq = y_sub * y_sub
+    hist = np.empty((3, n_fea, bins))
+    # 每次只统计一个特征，临时数组的大小只和样本数有关
+    for j in range(n_fea):
+        codes = X_binned[sub, j]
+        hist[0, j] = np.bincount(codes, minlength=bins)
+        hist[1, j] = np.bincount(codes, weights=y_sub, minlength=bins)
+        hist[2, j] = np.bincount(codes, weights=y_sq, minlength=bins)
+    return hist
+
+
+def child_histograms(build, hist, left, right):
+    '''只对样本少的子节点统计直方图，另一个子节点的直方图用父节点减去它得到
+    input:  build(function):build(sub)统计sub这些样本的直方图
+            hist(array):父节点的直方图
+            left, right(array):左右子节点的样本下标
+    output: (left_hist, right_hist)(tuple)
+    '''
+    if len(left) <= len(right):
+        left_hist = build(left)
+        return left_hist, hist - left_hist
+    right_hist = build(right)
+    return hist - right_hist, right_hist
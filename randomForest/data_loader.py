@@ -0,0 +1,190 @@
+# coding:UTF-8
+'''
+按列存放的数据加载：把分隔符分开的数值文件直接解析成连续的特征矩阵和整数编码的标签，
+随机森林、分类树和CART回归树共用。
+
+1、先数一遍文件的行数，特征矩阵只分配一次，之后按块(每块CHUNK_ROWS行)解析并填入，
+   字符串到数值的转换由NumPy完成，不需要对每个值调用float()。
+2、解析的结果缓存成和数据文件放在一起的.npy文件(<数据文件>.cache.*.npy)，用数据文件的修改时间
+   和大小作为缓存的键(保存在<数据文件>.cache.<kind>.json中)，数据文件没有变化时直接np.load，
+   每个数组只有一次内存分配。
+'''
+import json
+import os
+import numpy as np
+
+CHUNK_ROWS = 65536  # 每一块解析的行数
+
+
+def _count_lines(file_name):
+    '''按二进制块统计文件的行数，作为样本个数的上界'''
+    n = 0
+    last = b'\n'
+    with open(file_name, 'rb') as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            n += block.count(b'\n')
+            last = block[-1:]
+    return n + (last != b'\n')  # 最后一行没有换行符
+
+
+def _detect_delimiter(file_name):
+    '''有逗号时按逗号分隔，否则按空白(tab或空格)分隔'''
+    with open(file_name) as f:
+        for line in f:
+            if line.strip():
+                return ',' if ',' in line else None
+    return None
+
+
+def _read_chunks(file_name, delimiter, chunk_rows=CHUNK_ROWS):
+    '''每次返回chunk_rows行切分好的字段，跳过空行'''
+    rows = []
+    with open(file_name) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rows.append([x.strip() for x in line.split(delimiter)])
+            if len(rows) == chunk_rows:
+                yield rows
+                rows = []
+    if rows:
+        yield rows
+
+
+def encode_labels(raw):
+    '''把标签编码成整数
+    input:  raw(array):每个样本的标签，字符串或者数值
+    output: y(array):标签在classes中的下标
+            classes(list):排序后的所有标签，都是数值时为float，否则为字符串
+    '''
+    try:
+        raw = raw.astype(np.float64)
+    except ValueError:
+        pass
+    uniq, y = np.unique(raw, return_inverse=True)
+    classes = [float(c) if raw.dtype.kind == 'f' else str(c) for c in uniq]
+    return y.astype(np.intp), classes
+
+
+def parse_file(file_name, delimiter=None, dtype=np.float64, with_label=False):
+    '''按块解析数据文件，最后一列为标签
+    input:  file_name(string):数据文件
+            delimiter(string):分隔符，None表示自动判断逗号或者空白
+            dtype:特征矩阵的类型，np.float32或者np.float64
+            with_label(bool):True时标签也是数值，和特征放在同一个矩阵中
+    output: X(array):特征矩阵，with_label为True时最后一列为标签
+            raw(array):每个样本的标签，还没有编码的字符串，with_label为True时为None
+    '''
+    if delimiter is None:
+        delimiter = _detect_delimiter(file_name)
+    max_rows = _count_lines(file_name)
+    n_fea = 0 if with_label else 1  # 标签不放进矩阵时少一列
+    X, raw = None, []
+    m = 0
+    for rows in _read_chunks(file_name, delimiter):
+        table = np.array(rows)  # 字符串矩阵，每一行的字段个数必须相同
+        if X is None:
+            X = np.empty((max_rows, table.shape[1] - n_fea), dtype=dtype)  # 只分配一次
+        X[m:m + len(rows)] = table[:, :table.shape[1] - n_fea].astype(dtype)
+        if not with_label:
+            raw.append(table[:, -1])
+        m += len(rows)
+    if X is None:
+        X = np.empty((0, 0), dtype=dtype)
+    raw = None if with_label else (np.concatenate(raw) if raw else np.empty(0, dtype=str))
+    return X[:m], raw
+
+
+def iter_chunks(file_name, delimiter=None, dtype=np.float64, chunk_rows=CHUNK_ROWS):
+    '''按块读入全部为数值的数据文件，不缓存，占用的内存只和块的大小有关
+    input:  file_name(string):数据文件
+            delimiter(string):分隔符，None表示自动判断逗号或者空白
+            dtype:矩阵的类型
+            chunk_rows(int):每一块的行数
+    output: 每次返回一块的矩阵(array)
+    '''
+    if delimiter is None:
+        delimiter = _detect_delimiter(file_name)
+    for rows in _read_chunks(file_name, delimiter, chunk_rows):
+        yield np.array(rows).astype(dtype)
+
+
+def _cache_key(file_name, delimiter, dtype, kind):
+    '''缓存的键：数据文件的修改时间和大小，以及解析的参数'''
+    stat = os.stat(file_name)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size, 'delimiter': delimiter,
+            'dtype': np.dtype(dtype).str, 'kind': kind}
+
+
+def _load_cache(file_name, key, names):
+    '''键相同时返回缓存的数组和meta，否则返回None'''
+    try:
+        with open('%s.cache.%s.json' % (file_name, key['kind'])) as f:
+            meta = json.load(f)
+        if meta['key'] != key:
+            return None
+        return [np.load('%s.cache.%s.npy' % (file_name, name)) for name in names], meta
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def _save_cache(file_name, key, arrays, **meta):
+    try:
+        for name in arrays:
+            np.save('%s.cache.%s.npy' % (file_name, name), arrays[name])
+        meta['key'] = key
+        with open('%s.cache.%s.json' % (file_name, key['kind']), 'w') as f:  # 最后写meta，写到一半失败时缓存不会被当成有效的
+            json.dump(meta, f)
+    except (IOError, OSError):
+        pass  # 数据目录不可写时不缓存
+
+
+def load_matrix(file_name, delimiter=None, dtype=np.float64, classify=True, cache=True):
+    '''加载数据文件，最后一列为标签
+    input:  file_name(string):数据文件
+            delimiter(string):分隔符，None表示自动判断逗号或者空白
+            dtype:特征矩阵的类型，np.float32或者np.float64
+            classify(bool):True时把标签编码成整数(分类)，False时标签为数值(回归)
+            cache(bool):是否使用.npy缓存
+    output: X(array):特征矩阵
+            y(array):分类时为标签在classes中的下标，回归时为标签的值
+            classes(list):分类时为排序后的所有标签，回归时为None
+    '''
+    key = _cache_key(file_name, delimiter, dtype, 'classify' if classify else 'regression')
+    names = ('X_' + key['kind'], 'y_' + key['kind'])
+    if cache:
+        cached = _load_cache(file_name, key, names)
+        if cached is not None:
+            (X, y), meta = cached
+            return X, y, meta['classes']
+    X, raw = parse_file(file_name, delimiter, dtype)
+    if classify:
+        y, classes = encode_labels(raw)
+    else:
+        y, classes = raw.astype(np.float64), None
+    if cache:
+        _save_cache(file_name, key, {names[0]: X, names[1]: y}, classes=classes)
+    return X, y, classes
+
+
+def load_table(file_name, delimiter=None, dtype=np.float64, cache=True):
+    '''加载全部为数值的数据文件，返回包含标签列的矩阵，可以直接代替按行读入的list
+    input:  file_name(string):数据文件
+            delimiter(string):分隔符，None表示自动判断逗号或者空白
+            dtype:矩阵的类型
+            cache(bool):是否使用.npy缓存
+    output: data(array):m*(n+1)的矩阵，最后一列为标签
+    '''
+    key = _cache_key(file_name, delimiter, dtype, 'table')
+    if cache:
+        cached = _load_cache(file_name, key, ('table',))
+        if cached is not None:
+            return cached[0][0]
+    data, raw = parse_file(file_name, delimiter, dtype, with_label=True)
+    if cache:
+        _save_cache(file_name, key, {'table': data})
+    return data
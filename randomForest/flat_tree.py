@@ -0,0 +1,207 @@
+# coding:UTF-8
+'''
+把训练好的决策树编译成扁平的 NumPy 数组，并对整个测试矩阵做批量预测
+
+编译后的一棵树是一个 dict，包含 5 个等长的数组，第 i 个元素描述第 i 个节点：
+    feature     切分特征的列索引，叶节点为 -1
+    threshold   切分值，x[feature] < threshold 走左子树，否则走右子树
+    left        左子节点的下标，叶节点为 -1
+    right       右子节点的下标，叶节点为 -1
+    value       叶节点的值：类别在 classes 中的下标，或者回归树的预测值
+另外 depth 保存树的深度，也就是批量预测时需要推进的层数
+'''
+import numpy as np
+
+CHUNK_SIZE = 8192  # 批量预测时每一块的样本数，一块的数据能放进 CPU 缓存
+
+
+def _leaf_value(tree):
+    '''取出叶节点保存的值
+    input:  tree:randomForest01 的叶节点直接是类别标签，node 叶节点的 results
+            是 {类别: 个数} 的 dict (分类树) 或者 float (回归树)
+    output: 叶节点的值，dict 取出现次数最多的类别
+    '''
+    if hasattr(tree, 'results'):
+        tree = tree.results
+    if isinstance(tree, dict):
+        return max(tree, key=tree.get)
+    return tree
+
+
+def _children(tree):
+    '''返回内部节点的 (特征 index, 切分值, 左子树, 右子树)，叶节点返回 None
+    '''
+    if isinstance(tree, dict):
+        return tree['index'], tree['value'], tree['left'], tree['right']
+    if hasattr(tree, 'results'):
+        if tree.results is not None:
+            return None
+        if tree.left is None or tree.right is None:  # build_tree 对空的训练数据返回空的 node()
+            raise ValueError('node has neither children nor results, the tree was built from empty data')
+        return tree.fea, tree.value, tree.left, tree.right
+    return None
+
+
+def compile_tree(tree, feature=None, classes=None):
+    '''把一棵树编译成扁平的数组
+    input:  tree(dict/node):randomForest01 的字典树，或者 tree.py/train_cart.py 中的 node 树
+            feature(list):该树训练时选择的原始特征 index (trees_feature[i])，None 表示不需要映射
+            classes(list):类别标签表，叶节点保存类别在 classes 中的下标，新出现的类别追加到
+                          classes 的末尾；None 表示叶节点直接保存数值 (回归树)
+    output: flat(dict):feature/threshold/left/right/value 5 个数组
+    空的树(既没有子树也没有叶节点的值的 node)抛出 ValueError
+    '''
+    fea_list, thr_list, left_list, right_list, value_list = [], [], [], [], []
+    max_depth = 0
+    stack = [(tree, -1, False, 0)]  # (子树, 父节点下标, 是否为右子树, 深度)，用栈代替递归
+    while stack:
+        sub_tree, parent, is_right, depth = stack.pop()
+        max_depth = max(max_depth, depth)
+        idx = len(fea_list)
+        if parent >= 0:
+            if is_right:
+                right_list[parent] = idx
+            else:
+                left_list[parent] = idx
+        split = _children(sub_tree)
+        left_list.append(-1)
+        right_list.append(-1)
+        if split is None:
+            value = _leaf_value(sub_tree)
+            if classes is not None:
+                if value not in classes:
+                    classes.append(value)
+                value = classes.index(value)
+            fea_list.append(-1)
+            thr_list.append(0.0)
+            value_list.append(value)
+        else:
+            fea, thr, left, right = split
+            fea_list.append(feature[fea] if feature is not None else fea)
+            thr_list.append(thr)
+            value_list.append(0)
+            stack.append((right, idx, True, depth + 1))
+            stack.append((left, idx, False, depth + 1))
+
+    return {'feature': np.array(fea_list, dtype=np.int32),
+            'threshold': np.array(thr_list, dtype=np.float64),
+            'left': np.array(left_list, dtype=np.int32),
+            'right': np.array(right_list, dtype=np.int32),
+            'value': np.array(value_list, dtype=np.float64 if classes is None else np.int32),
+            'depth': max_depth}
+
+
+def compile_forest(trees, trees_feature=None):
+    '''编译整个森林，所有的树共用一张类别表
+    input:  trees(list):决策树的集合
+            trees_feature(list):每一棵树选择的原始特征，None 表示树直接使用原始特征
+    output: flat_trees(list):编译后的树
+            classes(list):类别标签表
+    '''
+    classes = []
+    flat_trees = []
+    for i in range(len(trees)):
+        feature = trees_feature[i] if trees_feature is not None else None
+        flat_trees.append(compile_tree(trees[i], feature, classes))
+    return flat_trees, classes
+
+
+def required_features(flat_trees):
+    '''编译后的树用到的特征个数，即最大的特征 index + 1
+    '''
+    return max([int(flat['feature'].max()) + 1 for flat in flat_trees if len(flat['feature'])] + [0])
+
+
+def check_features(n_required, X):
+    '''检查样本矩阵的列数是否覆盖了树用到的所有特征，不够时抛出 ValueError，而不是在推进时越界
+    input:  n_required(int):required_features 的返回值
+            X(array):样本矩阵
+    '''
+    if X.shape[0] > 0 and (X.ndim != 2 or X.shape[1] < n_required):
+        n_data = X.shape[1] if X.ndim == 2 else 0
+        raise ValueError('the model uses %d features but the data has only %d' % (n_required, n_data))
+
+
+def _routing(flat):
+    '''把叶节点的左右子节点都指向自己，这样所有样本可以一起推进 depth 层，不需要每层挑出未到达叶节点的样本
+    '''
+    leaf = flat['feature'] < 0
+    idx = np.arange(len(leaf))
+    return (np.where(leaf, 0, flat['feature']).astype(np.intp), flat['threshold'],
+            np.where(leaf, idx, flat['left']), np.where(leaf, idx, flat['right']), flat['depth'])
+
+
+def _apply_columns(route, Xt):
+    '''按层推进一块样本，Xt 是按列存放的样本 (特征数 X 样本数)，同一个特征的值是连续的
+    '''
+    fea, threshold, left, right, depth = route
+    m = Xt.shape[1]
+    Xf = Xt.ravel()
+    base = np.arange(m)
+    node_idx = np.zeros(m, dtype=np.intp)
+    for i in range(depth):
+        go_left = Xf[fea[node_idx] * m + base] < threshold[node_idx]
+        node_idx = np.where(go_left, left[node_idx], right[node_idx])
+    return node_idx
+
+
+def apply_tree(flat, X):
+    '''把所有样本按层同时推进到叶节点
+    input:  flat(dict):编译后的树
+            X(array):样本矩阵，每一行是一个样本
+    output: node_idx(array):每个样本落入的叶节点下标
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    check_features(required_features([flat]), X)
+    route = _routing(flat)
+    node_idx = np.zeros(X.shape[0], dtype=np.intp)
+    for start in range(0, X.shape[0], CHUNK_SIZE):
+        Xt = np.ascontiguousarray(X[start:start + CHUNK_SIZE].T)
+        node_idx[start:start + CHUNK_SIZE] = _apply_columns(route, Xt)
+    return node_idx
+
+
+def predict_tree(flat, X):
+    '''一棵树对所有样本的预测值
+    '''
+    return flat['value'][apply_tree(flat, X)]
+
+
+def sum_predict_batch(flat_trees, X):
+    '''回归树的集成(如梯度提升树)对所有样本的预测值之和
+    input:  flat_trees(list):编译后的回归树
+            X(array):样本矩阵
+    output: total(array):每个样本所有树的预测值之和
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    check_features(required_features(flat_trees), X)
+    routes = [_routing(flat) for flat in flat_trees]
+    total = np.zeros(X.shape[0])
+    for start in range(0, X.shape[0], CHUNK_SIZE):
+        Xt = np.ascontiguousarray(X[start:start + CHUNK_SIZE].T)  # 每一块只转置一次，所有的树共用
+        for flat, route in zip(flat_trees, routes):
+            total[start:start + Xt.shape[1]] += flat['value'][_apply_columns(route, Xt)]
+    return total
+
+
+def bagging_predict_batch(flat_trees, classes, X):
+    '''随机森林对所有样本投票
+    input:  flat_trees(list):编译后的树
+            classes(list):类别标签表
+            X(array):样本矩阵
+    output: predictions(array):每个样本得票最多的类别
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    check_features(required_features(flat_trees), X)
+    routes = [_routing(flat) for flat in flat_trees]
+    n_class = len(classes)
+    best = np.zeros(X.shape[0], dtype=np.intp)
+    for start in range(0, X.shape[0], CHUNK_SIZE):
+        Xt = np.ascontiguousarray(X[start:start + CHUNK_SIZE].T)  # 每一块只转置一次，所有的树共用
+        m = Xt.shape[1]
+        offset = np.arange(m) * n_class  # 第 i 个样本的票数存放在 votes[i * n_class: (i + 1) * n_class]
+        votes = np.zeros(m * n_class, dtype=np.int64)
+        for flat, route in zip(flat_trees, routes):
+            votes += np.bincount(offset + flat['value'][_apply_columns(route, Xt)], minlength=m * n_class)
+        best[start:start + m] = np.argmax(votes.reshape(m, n_class), axis=1)
+    return np.array(classes, dtype=object)[best]
@@ -0,0 +1,105 @@
+# coding:UTF-8
+'''
+随机森林的特征重要性
+
+1、基于不纯度：建树时每次划分把Gini指数的减少量(按样本权重加权)累加到划分特征的原始列上，
+   每棵树归一化后取平均，随森林一起返回，不需要再扫描数据。
+2、袋外置换：打乱一个特征的取值后袋外准确率的下降，各个特征之间相互独立，可以并行计算；
+   只有用到该特征的树需要重新预测袋外样本。
+'''
+from multiprocessing import Pool, cpu_count
+import numpy as np
+from flat_tree import predict_tree
+
+
+def normalize(importance):
+    '''把一棵树的特征重要性归一化，所有特征之和为1，没有划分的树全部为0
+    '''
+    total = importance.sum()
+    if total > 0:
+        return importance / total
+    return importance
+
+
+def _oob_accuracy(votes, y):
+    '''按袋外投票计算准确率，没有袋外投票的样本不参与计算'''
+    has_vote = votes.sum(axis=1) > 0
+    if not has_vote.any():
+        return 0.0
+    return float(np.mean(np.argmax(votes[has_vote], axis=1) == y[has_vote]))
+
+
+# 进程池中每个 worker 共享的森林和数据，在 worker 启动时只传一次
+_worker_oob = None
+
+
+def _init_worker(flat_trees, X, y, oob_sets, oob_preds, votes):
+    global _worker_oob
+    _worker_oob = (flat_trees, X, y, oob_sets, oob_preds, votes)
+
+
+def _permuted_accuracy(task):
+    return permuted_accuracy(*(_worker_oob + task))
+
+
+def permuted_accuracy(flat_trees, X, y, oob_sets, oob_preds, votes, j, col_seed):
+    '''打乱第j个特征后的袋外准确率
+    input:  flat_trees(list):编译后的树，特征为原始的列
+            X(array):训练数据的特征矩阵，计算时第j列被临时打乱
+            y(array):类标签的下标，与编译时的类别表一致
+            oob_sets(list):每棵树的袋外样本在X中的下标
+            oob_preds(list):每棵树对袋外样本的预测
+            votes(array):不打乱时的袋外投票
+            j(int):打乱的特征
+            col_seed(int):打乱用的随机种子
+    output: accuracy(float):袋外准确率，返回时X已经恢复原样
+    '''
+    # 只保存第j列，在X上原地打乱，不复制整个矩阵
+    col = X[:, j].copy()
+    X[:, j] = col[np.random.RandomState(col_seed).permutation(X.shape[0])]
+    try:
+        votes = votes.copy()
+        for flat, oob, oob_pred in zip(flat_trees, oob_sets, oob_preds):
+            if not np.any(flat['feature'] == j):  # 没有用到该特征的树预测不变
+                continue
+            votes[oob, oob_pred] -= 1
+            votes[oob, predict_tree(flat, X[oob])] += 1
+    finally:
+        X[:, j] = col
+    return _oob_accuracy(votes, y)
+
+
+def oob_permutation_importance(flat_trees, X, y, oob_sets, n_class, random_seed, n_jobs=1):
+    '''袋外置换的特征重要性
+    input:  flat_trees(list):编译后的树，特征为原始的列，叶节点为类别的下标
+            X(array):训练数据的特征矩阵
+            y(array):类标签的下标，与编译时的类别表一致
+            oob_sets(list):每棵树的袋外样本在X中的下标
+            n_class(int):类别的个数
+            random_seed(int):打乱特征用的随机种子
+            n_jobs(int):并行计算的进程数，1为串行，<=0为使用所有的CPU
+    output: importances(array):每个特征打乱后袋外准确率的下降
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    oob_preds = [predict_tree(flat, X[oob]) for flat, oob in zip(flat_trees, oob_sets)]
+    votes = np.zeros((X.shape[0], n_class), dtype=np.int64)
+    for oob, oob_pred in zip(oob_sets, oob_preds):
+        votes[oob, oob_pred] += 1
+    base = _oob_accuracy(votes, y)
+    # 每个特征的随机种子统一生成，串行和并行的结果完全一样
+    col_seeds = np.random.RandomState(random_seed).randint(2 ** 31 - 1, size=X.shape[1])
+    tasks = [(j, int(col_seeds[j])) for j in range(X.shape[1])]
+    if n_jobs <= 0:
+        n_jobs = cpu_count()
+    if n_jobs > 1 and len(tasks) > 1:
+        pool = Pool(min(n_jobs, len(tasks)), initializer=_init_worker,
+                    initargs=(flat_trees, X, y, oob_sets, oob_preds, votes))
+        try:
+            accuracy = pool.map(_permuted_accuracy, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        accuracy = [permuted_accuracy(flat_trees, X, y, oob_sets, oob_preds, votes, *task) for task in tasks]
+    return base - np.array(accuracy)
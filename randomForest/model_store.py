@@ -0,0 +1,170 @@
+# coding:UTF-8
+'''
+随机森林和CART回归树的二进制模型文件，加载时用mmap直接映射，不生成Python对象
+
+文件格式(小端)：
+    magic       8字节 b'TREEMDL\0'
+    version     uint32
+    meta_len    uint32，meta的字节数
+    meta        UTF-8编码的JSON：模型类型、类别标签、trees_feature、其它参数(extra)、每棵树的节点个数和深度、
+                每个数组的类型和相对于数组区开头的偏移
+    数组区      从meta之后的8字节对齐处开始，所有树的feature/threshold/left/right/value
+                依次拼接，每个数组按8字节对齐
+
+每棵树的节点数组与flat_tree.compile_tree的结果相同，left/right是树内部的下标。
+'''
+import json
+import mmap
+import os
+import struct
+import numpy as np
+from flat_tree import compile_tree, compile_forest
+
+MAGIC = b'TREEMDL\0'
+VERSION = 1
+HEADER = struct.Struct('<8sII')  # magic, version, meta_len
+
+CLASSIFY = 'classify'  # 随机森林，叶节点保存类别在classes中的下标
+REGRESSION = 'regression'  # 回归树，叶节点保存预测值
+BOOSTING = 'boosting'  # 梯度提升树，所有树的预测值相加，叶节点保存预测值
+
+
+def _fields(kind):
+    '''每个节点数组的名字和类型'''
+    value_dtype = '<i4' if kind == CLASSIFY else '<f8'
+    return [('feature', '<i4'), ('threshold', '<f8'), ('left', '<i4'), ('right', '<i4'), ('value', value_dtype)]
+
+
+def _align(n):
+    return (n + 7) // 8 * 8
+
+
+def save_flat(model_file, flat_trees, kind, classes=None, trees_feature=None, extra=None):
+    '''把编译后的树保存成二进制模型文件
+    input:  model_file(string):模型文件名
+            flat_trees(list):flat_tree.compile_tree编译后的树
+            kind(string):CLASSIFY、REGRESSION或者BOOSTING
+            classes(list):类别标签，回归树为None
+            trees_feature(list):每一棵树选择的原始特征，没有时为None
+            extra(dict):模型的其它参数(如梯度提升树的初始值和学习率)，保存在meta中
+    '''
+    fields = _fields(kind)
+    n_nodes = [len(flat['feature']) for flat in flat_trees]
+    total = sum(n_nodes)
+    # 1、每个数组相对于数组区开头的偏移
+    offset = 0
+    meta_fields = []
+    for name, dtype in fields:
+        meta_fields.append([name, dtype, offset])
+        offset = _align(offset + total * np.dtype(dtype).itemsize)
+    meta = {'kind': kind,
+            'classes': classes,
+            'trees_feature': trees_feature,
+            'n_nodes': n_nodes,
+            'depth': [int(flat['depth']) for flat in flat_trees],
+            'fields': meta_fields}
+    if extra:
+        meta['extra'] = extra
+    meta_bytes = json.dumps(meta).encode('utf-8')
+
+    # 2、依次写入头部、meta和所有的数组，先写临时文件再改名，正在mmap旧文件的进程不受影响
+    tmp_file = model_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(meta_bytes)))
+        f.write(meta_bytes)
+        data_start = _align(f.tell())
+        for name, dtype, offset in meta_fields:
+            f.write(b'\0' * (data_start + offset - f.tell()))
+            if total > 0:
+                data = np.concatenate([np.asarray(flat[name]) for flat in flat_trees]).astype(dtype)
+                f.write(data.tobytes())
+    os.rename(tmp_file, model_file)
+
+
+def save_forest(trees_result, trees_feature, model_file):
+    '''保存随机森林
+    input:  trees_result(list):训练好的分类树
+            trees_feature(list):每一棵分类树选择的特征，None表示直接使用原始特征
+            model_file(string):模型文件名
+    '''
+    flat_trees, classes = compile_forest(trees_result, trees_feature)
+    save_flat(model_file, flat_trees, CLASSIFY, classes, trees_feature)
+
+
+def save_regression_tree(regression_tree, model_file):
+    '''保存CART回归树
+    input:  regression_tree:回归树模型
+            model_file(string):模型文件名
+    '''
+    save_flat(model_file, [compile_tree(regression_tree)], REGRESSION)
+
+
+def load_flat(model_file):
+    '''用mmap加载二进制模型文件，节点数组直接引用映射的内存，多个进程可以共用page cache
+    input:  model_file(string):模型文件名
+    output: flat_trees(list):编译后的树
+            meta(dict):kind/classes/trees_feature等模型信息
+    '''
+    with open(model_file, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, meta_len = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError('%s is not a tree model file' % model_file)
+    if version != VERSION:
+        raise ValueError('unsupported tree model version %d' % version)
+    meta = json.loads(buf[HEADER.size:HEADER.size + meta_len].decode('utf-8'))
+
+    total = sum(meta['n_nodes'])
+    data_start = _align(HEADER.size + meta_len)
+    arrays = {}
+    for name, dtype, offset in meta['fields']:
+        if total > 0:
+            arrays[name] = np.frombuffer(buf, dtype=np.dtype(str(dtype)), count=total, offset=data_start + offset)
+        else:
+            arrays[name] = np.zeros(0, dtype=np.dtype(str(dtype)))
+
+    flat_trees = []
+    start = 0
+    for n_nodes, depth in zip(meta['n_nodes'], meta['depth']):
+        flat = dict((name, arrays[name][start:start + n_nodes]) for name in arrays)
+        flat['depth'] = depth
+        flat_trees.append(flat)
+        start += n_nodes
+    return flat_trees, meta
+
+
+def append_forest(model_file, trees_result, trees_feature, max_trees=None):
+    '''在二进制模型文件的随机森林后面追加新训练的树，已有的树不需要重新训练和编译
+    input:  model_file(string):模型文件名
+            trees_result(list):新训练的分类树
+            trees_feature(list):新的分类树选择的特征，None表示直接使用原始特征
+            max_trees(int):最多保留的树的个数，超过时淘汰最早的树，None表示不淘汰
+    output: n_trees(int):模型中树的个数
+    '''
+    flat_trees, meta = load_flat(model_file)
+    if meta['kind'] != CLASSIFY:
+        raise ValueError('%s is not a random forest model' % model_file)
+    classes = list(meta['classes'])  # 新出现的类别追加到末尾，已有的树的类别下标不变
+    old_feature = meta['trees_feature']
+    for i in range(len(trees_result)):
+        feature = trees_feature[i] if trees_feature is not None else None
+        flat_trees.append(compile_tree(trees_result[i], feature, classes))
+    if old_feature is not None or trees_feature is not None:
+        old_feature = old_feature or [None] * len(meta['n_nodes'])
+        trees_feature = old_feature + (trees_feature or [None] * len(trees_result))
+    # 滑动窗口：只保留最新的max_trees棵树
+    if max_trees is not None and len(flat_trees) > max_trees:
+        start = len(flat_trees) - max_trees
+        flat_trees = flat_trees[start:]
+        trees_feature = trees_feature[start:] if trees_feature is not None else None
+    save_flat(model_file, flat_trees, CLASSIFY, classes, trees_feature)
+    return len(flat_trees)
+
+
+def retire_trees(model_file, max_trees):
+    '''淘汰模型文件中最早的树，只保留最新的max_trees棵树
+    input:  model_file(string):模型文件名
+            max_trees(int):保留的树的个数
+    output: n_trees(int):模型中树的个数
+    '''
+    return append_forest(model_file, [], None, max_trees)
@@ -12,24 +12,20 @@ Random Forest Algorithm on Sonar Dataset
 Flying_sfeng博客地址：http://blog.csdn.net/flying_sfeng/article/details/64133822
 在此表示感谢你的代码和注解， 我重新也完善了个人注解
 '''
-from random import seed, randrange, random
+from random import seed, randrange, random, Random
+from multiprocessing import Pool, cpu_count, shared_memory
+import numpy as np
+from flat_tree import compile_tree, compile_forest, predict_tree, bagging_predict_batch
+from binning import bin_features, n_bins, class_histogram, child_histograms
+from importance import normalize, oob_permutation_importance
+from data_loader import load_matrix
 
 
 def loadDataSet(filename):
-    dataset = []
-    with open(filename, 'r') as fr:
-        for line in fr.readlines():
-            if not line:
-                continue
-            lineArr = []
-            for featrue in line.split(','):
-                str_f = featrue.strip()  # strip()返回移除字符串头尾指定的字符生成的新字符串
-                if str_f.isdigit():  # 判断是否是数字
-                    lineArr.append(float(str_f))  # 将数据集的第column列转换成float形式
-                else:
-                    lineArr.append(str_f)  # 添加分类标签
-            dataset.append(lineArr)
-    return dataset
+    # 特征由 NumPy 按块转换成 float，并缓存成 .npy；isdigit() 对 0.02 这样的小数返回 False，
+    # 原来逐个判断时小数会保留成字符串，按字典序比较
+    X, y, classes = load_matrix(filename, ',')
+    return [row + [classes[label]] for row, label in zip(X.tolist(), y)]
 
 
 def splitDataSet(dataset, n_folds):
@@ -53,80 +49,230 @@ def splitDataSet(dataset, n_folds):
     return dataset_split  # 由dataset分割出的n_folds个数据构成的列表，为了用于交叉验证，可能有重复的份
 
 
-# Split a dataset based on an attribute and an attribute value # 根据特征和特征值分割数据集
-def test_split(index, value, dataset):
-    left, right = list(), list()
-    for row in dataset:
-        if row[index] < value:
-            left.append(row)
-        else:
-            right.append(row)
-    return left, right
-
-
-# Calculate the Gini index for a split dataset
-def gini_index(groups, class_values):  # 个人理解：计算代价，分类越准确，则 gini 越小
-    gini = 0.0
-    for class_value in class_values:  # class_values = [0, 1]
-        for group in groups:  # groups = (left, right)
-            size = len(group)
-            if size == 0:
-                continue
-            proportion = [row[-1] for row in group].count(class_value) / float(size)
-            gini += (proportion * (1.0 - proportion))  # 个人理解：计算代价，分类越准确，则 gini 越小
-    return gini
-
-
-# 找出分割数据集的最优特征，得到最优的特征 index，特征值 row[index]，以及分割完的数据 groups（left, right）
-def getBestFeatures(dataset, n_features):
-    class_values = list(set(row[-1] for row in dataset))  # class_values =[0, 1]
-    b_index, b_value, b_score, b_groups = 999, 999, 999, None
+# 把数据集转换成一个连续的特征矩阵和整数编码的标签，建树过程中不再复制行
+def to_matrix(dataset):
+    """to_matrix(数据集转换成特征矩阵)
+
+    Args:
+        dataset         数据集，每一行最后一列是类别标签
+    Returns:
+        X               特征矩阵 m*n
+        y               类别标签在 classes 中的下标
+        classes         类别标签
+    """
+    classes = sorted(set(row[-1] for row in dataset))
+    class_index = dict((class_value, i) for i, class_value in enumerate(classes))
+    X = np.array([row[:-1] for row in dataset], dtype=np.float64)
+    y = np.array([class_index[row[-1]] for row in dataset], dtype=np.intp)
+    return X, y, classes
+
+
+# 随机选取 n_features 个不重复的特征，rng 为 None 时使用全局的随机状态
+def choose_features(n_total, n_features, rng=None):
+    rand = randrange if rng is None else rng.randrange
     features = list()
     while len(features) < n_features:
-        index = randrange(len(dataset[0]) - 1)  # 往 features 添加 n_features 个特征（ n_feature 等于特征数的根号），特征索引从 dataset 中随机取
+        index = rand(n_total)
         if index not in features:
             features.append(index)
-    for index in features:  # 在 n_features 个特征中选出最优的特征索引，并没有遍历所有特征，从而保证了每课决策树的差异性
-        for row in dataset:
-            groups = test_split(index, row[index], dataset)  # groups=(left, right), row[index] 遍历每一行 index 索引下的特征值作为分类值 value, 找出最优的分类特征和特征值
-            gini = gini_index(groups, class_values)
-            # 左右两边的数量越一样，说明数据区分度不高，gini系数越大
+    return features
+
+
+# 在 sub 这些样本上找出 gini 最小的特征和特征值，每个特征在特征矩阵上排序扫描一次
+def best_split(X, y, n_class, sub, n_features, weights, rng=None):
+    """best_split(找出最优的切分)
+
+    Args:
+        X               特征矩阵
+        y               类别标签的下标
+        n_class         类别的个数
+        sub             当前节点的样本在 X 中的下标
+        n_features      选取的特征的个数
+        weights         每个样本的权重 (被抽中的次数)，按权重计算各类别的比例
+        rng             选取特征用的 random.Random，None 表示使用全局的随机状态
+    Returns:
+        b_index         最优的特征 index
+        b_value         最优的特征值，X[:, b_index] < b_value 的样本分到左边
+    """
+    b_index, b_value, b_score = 999, 999, 999
+    features = choose_features(X.shape[1], n_features, rng)
+    n = weights[sub].sum()
+    onehot = np.eye(n_class)[y[sub]] * weights[sub][:, None]
+    for index in features:
+        values = X[sub, index]
+        order = np.argsort(values, kind='mergesort')  # 每个节点每个特征只排序一次
+        values = values[order]
+        counts = np.zeros((len(sub) + 1, n_class))
+        counts[1:] = np.cumsum(onehot[order], axis=0)  # counts[i] 为排序后前 i 个样本中各类别的权重之和
+        first = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])  # 每个不同取值第一次出现的位置
+        left = counts[first]  # 严格小于该取值的样本分到左边
+        n_left = left.sum(axis=1)
+        right = counts[-1] - left
+        n_right = n - n_left
+        n_left[n_left == 0] = 1  # 空的分组各类别的权重都为 0，不影响结果
+        n_right[n_right == 0] = 1
+        # gini 为左右两组中各类别的 proportion * (1 - proportion) 之和，分类越准确，则 gini 越小
+        gini = np.zeros(len(first))
+        for class_value in range(n_class):
+            proportion = left[:, class_value] / n_left
+            gini += proportion * (1.0 - proportion)
+            proportion = right[:, class_value] / n_right
+            gini += proportion * (1.0 - proportion)
+        ties = np.flatnonzero(gini == gini.min())
+        i = ties[np.argmin(order[first[ties]])]  # gini 相同时取在节点中最先出现的取值
+        if gini[i] < b_score:
+            b_index, b_value, b_score = index, float(values[first[i]]), gini[i]
+    return b_index, b_value
+
+
+# 在节点的直方图上找出最优的特征和箱子，不需要排序，只扫描每个特征的箱子
+def best_split_hist(hist, n_features, cuts, rng=None):
+    """best_split_hist(按直方图找出最优的切分)
+
+    Args:
+        hist            节点的直方图，hist[index, b, c] 为第 index 个特征落在第 b 个箱子的 c 类样本的权重之和
+        n_features      选取的特征的个数
+        cuts            每个特征的箱子切分点，bin_features 的返回值
+        rng             选取特征用的 random.Random，None 表示使用全局的随机状态
+    Returns:
+        b_index         最优的特征 index
+        b_value         最优的特征值，X[:, b_index] < b_value 的样本分到左边
+        b_bin           最优的箱子，X_binned[:, b_index] < b_bin 与 X[:, b_index] < b_value 等价
+    """
+    b_index, b_value, b_bin, b_score = 999, 999, 0, 999
+    features = choose_features(hist.shape[0], n_features, rng)
+    total = hist[0].sum(axis=0)
+    n = total.sum()
+    for index in features:
+        n_cut = len(cuts[index])
+        if n_cut == 0:  # 这个特征只有一个取值，只能把所有样本分到右边
+            proportion = total / n
+            gini = np.sum(proportion * (1.0 - proportion))
             if gini < b_score:
-                b_index, b_value, b_score, b_groups = index, row[index], gini, groups  # 最后得到最优的分类特征 b_index,分类特征值 b_value,分类结果 b_groups。b_value 为分错的代价成本
-    # print b_score
-    return {'index': b_index, 'value': b_value, 'groups': b_groups}
-
-
-# Create a terminal node value # 输出group中出现次数较多的标签
-def to_terminal(group):
-    outcomes = [row[-1] for row in group]  # max() 函数中，当 key 参数不为空时，就以 key 的函数对象为判断的标准
-    return max(set(outcomes), key=outcomes.count)  # 输出 group 中出现次数较多的标签
-
-
-# Create child splits for a node or make terminal  # 创建子分割器，递归分类，直到分类结束
-def split(node, max_depth, min_size, n_features, depth):  # max_depth = 10, min_size = 1, n_features = int(sqrt((dataset[0])-1))
-    left, right = node['groups']
-    del (node['groups'])
-    # check for a no split
-    if not left or not right:
-        node['left'] = node['right'] = to_terminal(left + right)
-        return
-    # check for max depth
-    if depth >= max_depth:  # max_depth=10 表示递归十次，若分类还未结束，则选取数据中分类标签较多的作为结果，使分类提前结束，防止过拟合
-        node['left'], node['right'] = to_terminal(left), to_terminal(right)
-        return
-    # process left child
-    if len(left) <= min_size:
-        node['left'] = to_terminal(left)
-    else:
-        node['left'] = getBestFeatures(left, n_features)  # node['left']是一个字典，形式为{'index':b_index, 'value':b_value, 'groups':b_groups}，所以node是一个多层字典
-        split(node['left'], max_depth, min_size, n_features, depth + 1)  # 递归，depth+1计算递归层数
-    # process right child
-    if len(right) <= min_size:
-        node['right'] = to_terminal(right)
-    else:
-        node['right'] = getBestFeatures(right, n_features)
-        split(node['right'], max_depth, min_size, n_features, depth + 1)
+                b_index, b_value, b_bin, b_score = index, float('-inf'), 0, gini
+            continue
+        left = np.cumsum(hist[index], axis=0)[:n_cut]  # left[t - 1] 为前 t 个箱子中各类别的权重之和
+        n_left = left.sum(axis=1)
+        right = total - left
+        n_right = n - n_left
+        n_left[n_left == 0] = 1
+        n_right[n_right == 0] = 1
+        gini = np.zeros(n_cut)
+        for class_value in range(hist.shape[2]):
+            proportion = left[:, class_value] / n_left
+            gini += proportion * (1.0 - proportion)
+            proportion = right[:, class_value] / n_right
+            gini += proportion * (1.0 - proportion)
+        i = np.argmin(gini)
+        if gini[i] < b_score:
+            b_index, b_value, b_bin, b_score = index, float(cuts[index][i]), i + 1, gini[i]
+    return b_index, b_value, b_bin
+
+
+# 把 idx[start:end] 原地划分成左右两段，X[:, index] < value 的样本下标在前，返回分界的位置
+def partition(X, idx, start, end, index, value):
+    sub = idx[start:end]
+    mask = X[sub, index] < value
+    idx[start:end] = np.concatenate((sub[mask], sub[~mask]))
+    return start + np.count_nonzero(mask)
+
+
+# 一次划分按权重计算的 Gini 指数减少量 n*G - n_left*G_left - n_right*G_right，作为划分特征的重要性
+def impurity_decrease(y, weights, n_class, left, right):
+    """impurity_decrease(划分的不纯度减少量)
+
+    Args:
+        y               类别标签的下标
+        weights         每个样本的权重
+        n_class         类别的个数
+        left            左子树的样本下标
+        right           右子树的样本下标
+    Returns:
+        decrease        加权的 Gini 指数减少量
+    """
+    counts_left = np.bincount(y[left], weights=weights[left], minlength=n_class)
+    counts_right = np.bincount(y[right], weights=weights[right], minlength=n_class)
+    decrease = 0.0
+    for counts, sign in ((counts_left + counts_right, 1), (counts_left, -1), (counts_right, -1)):
+        n = counts.sum()
+        if n > 0:
+            decrease += sign * (n - (counts ** 2).sum() / n)  # n * (1 - sum(p^2))
+    return decrease
+
+
+# 输出 sub 这些样本中权重之和 (出现次数) 较多的标签
+def terminal(y, sub, classes, weights):
+    return classes[np.argmax(np.bincount(y[sub], weights=weights[sub], minlength=len(classes)))]
+
+
+def grow_tree(X, y, classes, idx, max_depth, min_size, n_features, weights=None, bins=None, importance=None, rng=None):
+    """grow_tree(在共享的特征矩阵上创建一个决策树)
+
+    每个节点只对应 idx 中的一段 [start, end)，切分时在 idx 上原地划分，不复制数据；
+    用栈代替递归，树再深也不会超过递归的层数限制。
+
+    Args:
+        X               特征矩阵
+        y               类别标签的下标
+        classes         类别标签
+        idx             参与建树的样本在 X 中的下标，会被原地重新排列
+        max_depth       决策树深度不能太深，不然容易导致过拟合
+        min_size        叶子节点的大小
+        n_features      选取的特征的个数
+        weights         每个样本的权重，bootstrap 抽样时为样本被抽中的次数，None 表示都为 1
+        bins            (X_binned, cuts)，bin_features 的返回值，不为 None 时用直方图找切分
+        importance      长度为特征数的数组，不为 None 时把每次划分的不纯度减少量累加到划分的特征上
+        rng             选取特征用的 random.Random，None 表示使用全局的随机状态
+    Returns:
+        root            决策树，与 build_tree 的格式相同
+    """
+    n_class = len(classes)
+    if weights is None:
+        weights = np.ones(len(y))
+    hist = None
+    if bins is not None:
+        X_binned, cuts = bins
+        size = n_bins(cuts)
+        build_hist = lambda sub: class_histogram(X_binned, y, weights, sub, size, n_class)
+        hist = build_hist(idx)
+    root = None
+    stack = [(None, None, 0, len(idx), 1, hist)]  # (父节点, 左/右, start, end, 深度, 直方图)
+    while stack:
+        parent, side, start, end, depth, hist = stack.pop()
+        if hist is None:
+            index, value = best_split(X, y, n_class, idx[start:end], n_features, weights, rng)
+        else:
+            index, value, b_bin = best_split_hist(hist, n_features, cuts, rng)
+        node = {'index': index, 'value': value}
+        if parent is None:
+            root = node
+        else:
+            parent[side] = node
+        if hist is None:
+            mid = partition(X, idx, start, end, index, value)
+        else:
+            mid = partition(X_binned, idx, start, end, index, b_bin)  # 与按原始特征值划分的结果相同
+        # check for a no split
+        if mid == start or mid == end:
+            node['left'] = node['right'] = terminal(y, idx[start:end], classes, weights)
+            continue
+        if importance is not None:
+            importance[index] += impurity_decrease(y, weights, n_class, idx[start:mid], idx[mid:end])
+        # check for max depth
+        if depth >= max_depth:
+            node['left'], node['right'] = terminal(y, idx[start:mid], classes, weights), terminal(y, idx[mid:end], classes, weights)
+            continue
+        children = {'left': None, 'right': None}
+        if hist is not None:
+            # 只统计样本少的子节点的直方图，另一个用父节点的直方图减去它
+            children['left'], children['right'] = child_histograms(build_hist, hist, idx[start:mid], idx[mid:end])
+        # 先压入右子树，保证先处理左子树
+        for side, child_start, child_end in (('right', mid, end), ('left', start, mid)):
+            if weights[idx[child_start:child_end]].sum() <= min_size:  # 按权重计算叶子节点的大小，与复制样本时相同
+                node[side] = terminal(y, idx[child_start:child_end], classes, weights)
+            else:
+                stack.append((node, side, child_start, child_end, depth + 1, children[side]))
+    return root
 
 
 def build_tree(train, max_depth, min_size, n_features):
@@ -140,69 +286,125 @@ def build_tree(train, max_depth, min_size, n_features):
         root            返回决策树
     """
 
+    X, y, classes = to_matrix(train)
+    # 对左右2边的数据 进行循环的切分，由于最优特征使用过，所以在后面进行使用的时候，就没有意义了
+    # 例如： 性别-男女，对男使用这一特征就没任何意义了
+    return grow_tree(X, y, classes, np.arange(len(y)), max_depth, min_size, n_features)
 
-    root = getBestFeatures(train, n_features)# 返回最优列和相关的信息
 
-    # 对左右2边的数据 进行递归的调用，由于最优特征使用过，所以在后面进行使用的时候，就没有意义了
-    # 例如： 性别-男女，对男使用这一特征就没任何意义了
-    split(root, max_depth, min_size, n_features, 1)
-    return root
+# 进程池中每个 worker 共享的训练数据，在 worker 启动时只传一次，不随每个任务 pickle
+_worker_train = None
+_worker_bins = None
 
 
-# Make a prediction with a decision tree
-def predict(node, row):  # 预测模型分类结果
-    if row[node['index']] < node['value']:
-        if isinstance(node['left'], dict):  # isinstance 是 Python 中的一个内建函数。是用来判断一个对象是否是一个已知的类型。
-            return predict(node['left'], row)
-        else:
-            return node['left']
-    else:
-        if isinstance(node['right'], dict):
-            return predict(node['right'], row)
-        else:
-            return node['right']
+def _init_worker(X, y, classes, bins=None):
+    global _worker_train, _worker_bins
+    _worker_train = (X, y, classes)
+    _worker_bins = bins
 
 
-# Make a prediction with a list of bagged trees
-def bagging_predict(trees, row):
-    """bagging_predict(bagging预测)
+# 用每个样本被抽中的次数表示有放回的随机子样本，不复制样本
+def bootstrap_weights(n, ratio, rng=None):
+    """bootstrap_weights(按权重表示的随机子样本)
 
     Args:
-        trees           决策树的集合
-        row             测试数据集的每一行数据
+        n               训练数据集的样本个数
+        ratio           训练数据集的样本比例
+        rng             抽样用的 random.Random，None 表示使用全局的随机状态
     Returns:
-        返回随机森林中，决策树结果出现次数做大的
+        weights         weights[i] 为第 i 个样本被抽中的次数，没有被抽中的为 0
     """
+    rand = randrange if rng is None else rng.randrange
+    weights = np.zeros(n)
+    for i in range(round(n * ratio)):
+        weights[rand(n)] += 1  # 有放回的随机采样，保证每棵决策树训练集的差异性
+    return weights
 
-    # 使用多个决策树trees对测试集test的第row行进行预测，再使用简单投票法判断出该行所属分类
-    predictions = [predict(tree, row) for tree in trees]
-    return max(set(predictions), key=predictions.count)
 
-
-# Create a random subsample from the dataset with replacement
-def subsample(dataset, ratio):  # 创建数据集的随机子样本
-    """random_forest(评估算法性能，返回模型得分)
+def build_seeded_tree(X, y, classes, tree_seed, max_depth, min_size, sample_size, n_features, bins=None):
+    """build_seeded_tree(用固定的随机种子抽样并创建一棵决策树，保证结果可以复现)
 
     Args:
-        dataset         训练数据集
-        ratio           训练数据集的样本比例
+        X               特征矩阵
+        y               类别标签的下标
+        classes         类别标签
+        tree_seed       这棵树的随机种子
+        max_depth       决策树深度不能太深，不然容易导致过拟合
+        min_size        叶子节点的大小
+        sample_size     训练数据集的样本比例
+        n_features      选取的特征的个数
+        bins            (X_binned, cuts)，不为 None 时用直方图找切分
     Returns:
-        sample          随机抽样的训练样本
+        tree            决策树
+        oob             袋外样本在 X 中的下标，即这棵树没有抽中的样本
+        oob_pred        这棵树对袋外样本的预测，类别标签的下标
+        importance      这棵树归一化的特征重要性
     """
+    rng = Random(tree_seed)  # 每棵树自己的随机状态，不修改全局的随机状态
+    weights = bootstrap_weights(len(y), sample_size, rng)  # 随机抽样的训练样本， 随机采样保证了每棵决策树训练集的差异性
+    idx = np.flatnonzero(weights)  # 只有被抽中的样本参与建树
+    importance = np.zeros(X.shape[1])
+    tree = grow_tree(X, y, classes, idx, max_depth, min_size, n_features, weights, bins, importance, rng)  # 创建一个决策树
+    oob = np.flatnonzero(weights == 0)
+    oob_pred = predict_tree(compile_tree(tree, classes=list(classes)), X[oob])
+    return tree, oob, oob_pred, normalize(importance)
 
-    sample = list()
-    # 训练样本的按比例抽样。
-    # round() 方法返回浮点数x的四舍五入值。
-    n_sample = round(len(dataset) * ratio)
-    while len(sample) < n_sample:
-        # 有放回的随机采样，有一些样本被重复采样，从而在训练集中多次出现，有的则从未在训练集中出现，此则自助采样法。从而保证每棵决策树训练集的差异性
-        index = randrange(len(dataset))
-        sample.append(dataset[index])
-    return sample
+
+def _build_worker_tree(args):
+    return build_seeded_tree(*(_worker_train + args), bins=_worker_bins)
+
+
+def train_forest(X, y, classes, max_depth, min_size, sample_size, tree_size, n_features, n_jobs=1, bins=None, oob_sets=None, rng=None):
+    """train_forest(创建随机森林，边建树边累计袋外样本的投票)
+
+    Args:
+        X               特征矩阵
+        y               类别标签的下标
+        classes         类别标签
+        max_depth       决策树深度不能太深，不然容易导致过拟合
+        min_size        叶子节点的大小
+        sample_size     训练数据集的样本比例
+        tree_size       决策树的个数
+        n_features      选取的特征的个数
+        n_jobs          并行建树的进程数，1 为串行，<= 0 为使用所有的 CPU
+        bins            (X_binned, cuts)，bin_features 的返回值，不为 None 时用直方图找切分
+        oob_sets        不为 None 时把每棵树的袋外样本下标依次追加到这个 list 中
+        rng             生成每棵树随机种子的 random.Random，None 表示使用全局的随机状态
+    Returns:
+        trees           决策树的集合
+        oob_votes       m*类别数，oob_votes[i, j] 为没有抽中第 i 个样本的树把它预测成 classes[j] 的票数
+        importances     每个特征的重要性，每棵树归一化的不纯度减少量的平均值
+    """
+    # 每棵树的随机种子由当前的随机状态统一生成，串行和并行得到的森林完全一样
+    rand = randrange if rng is None else rng.randrange
+    tree_args = [(rand(2 ** 31), max_depth, min_size, sample_size, n_features) for i in range(tree_size)]
+    if n_jobs <= 0:
+        n_jobs = cpu_count()
+    pool = None
+    if n_jobs > 1 and tree_size > 1:
+        pool = Pool(min(n_jobs, tree_size), initializer=_init_worker, initargs=(X, y, classes, bins))
+        results = pool.imap(_build_worker_tree, tree_args)  # 树之间相互独立，每个任务只传种子和参数，按顺序返回
+    else:
+        results = (build_seeded_tree(X, y, classes, *args, bins=bins) for args in tree_args)
+    trees = list()
+    oob_votes = np.zeros((len(y), len(classes)), dtype=np.int64)
+    importances = np.zeros(X.shape[1])
+    try:
+        for tree, oob, oob_pred, importance in results:
+            trees.append(tree)
+            oob_votes[oob, oob_pred] += 1  # 每棵树只给它的袋外样本投票
+            importances += importance
+            if oob_sets is not None:
+                oob_sets.append(oob)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return trees, oob_votes, importances / max(len(trees), 1)
 
 
 # Random Forest Algorithm
-def random_forest(train, test, max_depth, min_size, sample_size, tree_size, n_features):
+def random_forest(train, test, max_depth, min_size, sample_size, tree_size, n_features, n_jobs=1, max_bins=None, rng=None):
     """random_forest(评估算法性能，返回模型得分)
 
     Args:
@@ -213,19 +415,58 @@ def random_forest(train, test, max_depth, min_size, sample_size, tree_size, n_fe
         sample_size     训练数据集的样本比例
         tree_size         决策树的个数
         n_features      选取的特征的个数
+        n_jobs          并行建树的进程数，1 为串行，<= 0 为使用所有的 CPU
+        max_bins        每个特征量化成的箱子个数 (<= 256)，None 表示不量化，按排序扫描找切分
+        rng             random.Random，None 表示使用全局的随机状态
     Returns:
         predictions     每一行的预测结果，bagging 预测最后的分类结果
     """
 
-    trees = list()
-    for i in range(tree_size):
-        sample = subsample(train, sample_size)  # 随机抽样的训练样本， 随机采样保证了每棵决策树训练集的差异性
-        tree = build_tree(sample, max_depth, min_size, n_features) # 创建一个决策树
-        trees.append(tree)
-    predictions = [bagging_predict(trees, row) for row in test] # 每一行的预测结果，bagging 预测最后的分类结果
+    X, y, classes = to_matrix(train)  # 整个森林共用一个特征矩阵
+    bins = bin_features(X, max_bins) if max_bins else None  # 只量化一次，所有的树共用
+    trees, oob_votes, importances = train_forest(X, y, classes, max_depth, min_size, sample_size, tree_size, n_features, n_jobs, bins, rng=rng)
+    # 把森林编译成扁平数组，整个测试集一次性按层推进所有的树，再用 bincount 投票
+    flat_trees, classes = compile_forest(trees)
+    predictions = list(bagging_predict_batch(flat_trees, classes, [row[:-1] for row in test]))  # 每一行的预测结果，bagging 预测最后的分类结果
     return predictions
 
 
+def random_forest_oob(train, max_depth, min_size, sample_size, tree_size, n_features, n_jobs=1, max_bins=None, permutation=False):
+    """random_forest_oob(创建随机森林，用袋外样本估计泛化的准确率，只需要训练一次，不需要交叉验证)
+
+    Args:
+        train           训练数据集
+        max_depth       决策树深度不能太深，不然容易导致过拟合
+        min_size        叶子节点的大小
+        sample_size     训练数据集的样本比例
+        tree_size       决策树的个数
+        n_features      选取的特征的个数
+        n_jobs          并行建树的进程数，1 为串行，<= 0 为使用所有的 CPU
+        max_bins        每个特征量化成的箱子个数 (<= 256)，None 表示不量化，按排序扫描找切分
+        permutation     为 True 时 importances 为袋外置换的特征重要性，按特征并行计算
+    Returns:
+        trees               决策树的集合
+        oob_accuracy        袋外样本的准确率，百分比
+        oob_predictions     每一行的袋外预测结果，没有树把该行留在袋外时为 NaN (与 randomforests_train 相同)，不参与准确率的计算
+        importances         每个特征的重要性：建树时累计的不纯度减少量，或者打乱该特征后袋外准确率的下降
+    """
+    X, y, classes = to_matrix(train)
+    bins = bin_features(X, max_bins) if max_bins else None
+    oob_sets = list() if permutation else None
+    perm_seed = randrange(2 ** 31)  # 在建树之前生成，与串行还是并行建树无关
+    trees, oob_votes, importances = train_forest(X, y, classes, max_depth, min_size, sample_size, tree_size, n_features, n_jobs, bins, oob_sets)
+    if permutation:
+        flat_trees = [compile_tree(tree, classes=list(classes)) for tree in trees]
+        importances = oob_permutation_importance(flat_trees, X, y, oob_sets, len(classes), perm_seed, n_jobs)
+    best = np.argmax(oob_votes, axis=1)
+    has_vote = oob_votes.sum(axis=1) > 0
+    oob_predictions = [classes[best[i]] if has_vote[i] else np.nan for i in range(len(y))]
+    actual = [train[i][-1] for i in range(len(y)) if has_vote[i]]
+    predicted = [oob_predictions[i] for i in range(len(y)) if has_vote[i]]
+    oob_accuracy = accuracy_metric(actual, predicted) if actual else None
+    return trees, oob_accuracy, oob_predictions, importances
+
+
 # Calculate accuracy percentage
 def accuracy_metric(actual, predicted):  # 导入实际值和预测值，计算精确度
     correct = 0
@@ -268,6 +509,169 @@ def evaluate_algorithm(dataset, algorithm, n_folds, *args):
     return scores
 
 
+# 用下标表示 splitDataSet 的 n_folds 份数据，抽样的方式和 splitDataSet 相同
+def split_indices(n, n_folds):
+    """split_indices(将数据集的下标进行有放回的抽样，分成 n_folds 份)
+
+    Args:
+        n           数据集的样本个数
+        n_folds     数据集分成n_flods份
+    Returns:
+        folds       n_folds*每份的大小，folds[k] 为第 k 份数据的样本下标
+    """
+    fold_size = n / n_folds
+    folds = list()
+    for i in range(n_folds):
+        fold = list()
+        while len(fold) < fold_size:
+            fold.append(randrange(n))
+        folds.append(fold)
+    return np.array(folds, dtype=np.intp)
+
+
+def evaluate_fold(X, y, classes, folds, k, fold_seed, algorithm, *args):
+    """evaluate_fold(第 k 份数据作为测试数据，其余的作为训练数据，返回模型得分)
+
+    Args:
+        X           特征矩阵
+        y           类别标签的下标
+        classes     类别标签
+        folds       每一份数据的样本下标
+        k           作为测试数据的那一份
+        fold_seed   这一份数据的随机种子
+        algorithm   使用的算法，algorithm(train_set, test_set, *args, rng=rng)，比如 random_forest
+        *args       其他的参数
+    Returns:
+        accuracy    模型得分
+    """
+    rng = Random(fold_seed)  # 每一份数据自己的随机状态，串行和并行的得分完全一样，不修改全局的随机状态
+    train_idx = np.concatenate([folds[i] for i in range(len(folds)) if i != k])
+    test_idx = folds[k]
+    # algorithm 的输入是一行一个 list，训练和测试数据在这里按下标生成，测试数据的标签为 None
+    train_set = [X[i].tolist() + [classes[y[i]]] for i in train_idx]
+    test_set = [X[i].tolist() + [None] for i in test_idx]
+    predicted = algorithm(train_set, test_set, *args, rng=rng)
+    actual = [classes[y[i]] for i in test_idx]
+    return accuracy_metric(actual, predicted)
+
+
+# 交叉验证的 worker 共享的数据：特征矩阵、标签和每一份数据的下标放在共享内存中，只保存一份
+_worker_cv = None
+
+
+def _share_array(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return shm
+
+
+def _init_cv_worker(specs, classes, algorithm, args):
+    global _worker_cv
+    shms = [shared_memory.SharedMemory(name=name) for name, shape, dtype in specs]
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=shm.buf) for shm, (name, shape, dtype) in zip(shms, specs)]
+    _worker_cv = (shms, arrays, classes, algorithm, args)  # shms 需要一直引用，否则共享内存会被关闭
+
+
+def _evaluate_worker_fold(task):
+    shms, (X, y, folds), classes, algorithm, args = _worker_cv
+    k, fold_seed = task
+    return evaluate_fold(X, y, classes, folds, k, fold_seed, algorithm, *args)
+
+
+# 并行的交叉验证，每一份数据在一个进程中训练和评估
+def evaluate_algorithm_parallel(dataset, algorithm, n_folds, n_jobs, *args):
+    """evaluate_algorithm_parallel(评估算法性能，返回模型得分)
+
+    与 evaluate_algorithm 相同的抽样方式，数据集只转换一次放在共享内存中，
+    每一份数据用下标表示，多份数据在多个进程中同时训练。
+    共享内存只省去了把整个数据集 pickle 给每个进程：每一份数据的训练和测试行仍然在 worker 中
+    按下标生成 list (evaluate_fold)，每个进程各有一份自己的训练数据。
+    algorithm 中不能再使用进程池，比如 random_forest 的 n_jobs 需要为 1。
+
+    Args:
+        dataset     原始数据集
+        algorithm   使用的算法，algorithm(train_set, test_set, *args, rng=rng) 返回 test_set 的预测结果，
+                    rng 为这一份数据的 random.Random
+        n_folds     数据的份数
+        n_jobs      并行的进程数，1 为串行，<= 0 为使用所有的 CPU
+        *args       其他的参数
+    Returns:
+        scores      模型得分
+    """
+    X, y, classes = to_matrix(dataset)
+    folds = split_indices(len(y), n_folds)
+    tasks = [(k, randrange(2 ** 31)) for k in range(n_folds)]  # (第几份数据, 随机种子)
+    if n_jobs <= 0:
+        n_jobs = cpu_count()
+    if n_jobs <= 1 or n_folds <= 1:
+        return [evaluate_fold(X, y, classes, folds, k, fold_seed, algorithm, *args) for k, fold_seed in tasks]
+
+    shms = [_share_array(array) for array in (X, y, folds)]
+    specs = [(shm.name, array.shape, array.dtype) for shm, array in zip(shms, (X, y, folds))]
+    try:
+        pool = Pool(min(n_jobs, n_folds), initializer=_init_cv_worker, initargs=(specs, classes, algorithm, args))
+        try:
+            scores = pool.map(_evaluate_worker_fold, tasks, chunksize=1)  # 每个任务只传第几份数据和随机种子
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+    return scores
+
+
+def prefix_accuracy(trees, classes, test):
+    """prefix_accuracy(按顺序累计每棵树的投票，得到前 1..N 棵树组成的森林的准确率)
+
+    Args:
+        trees       决策树的集合
+        classes     训练时的类别标签，与 to_matrix 返回的顺序相同
+        test        测试数据集，最后一列为真实的类别标签
+    Returns:
+        curve       curve[i] 为前 i+1 棵树投票的准确率
+    """
+    X = np.array([row[:-1] for row in test], dtype=np.float64)
+    actual = np.array([row[-1] for row in test], dtype=object)
+    labels = np.array(classes, dtype=object)
+    rows = np.arange(len(test))
+    votes = np.zeros((len(test), len(classes)), dtype=np.int64)  # 前面所有树的累计票数
+    curve = list()
+    for tree in trees:
+        votes[rows, predict_tree(compile_tree(tree, classes=list(classes)), X)] += 1
+        curve.append(float(np.mean(labels[np.argmax(votes, axis=1)] == actual)) * 100.0)
+    return curve
+
+
+# 每一份数据只训练一个最大的森林，一次得到所有树的个数下的得分
+def evaluate_prefix(dataset, n_folds, max_depth, min_size, sample_size, tree_size, n_features, n_jobs=1):
+    """evaluate_prefix(评估 1..tree_size 棵树的随机森林的性能)
+
+    Args:
+        dataset         原始数据集
+        n_folds         数据的份数
+        max_depth       决策树深度不能太深，不然容易导致过拟合
+        min_size        叶子节点的大小
+        sample_size     训练数据集的样本比例
+        tree_size       最多的决策树的个数
+        n_features      选取的特征的个数
+        n_jobs          并行建树的进程数，1 为串行，<= 0 为使用所有的 CPU
+    Returns:
+        curves          curves[k][i] 为第 k 份数据上前 i+1 棵树的得分，与 evaluate_algorithm 的 scores[k] 对应
+    """
+    splitDatas = splitDataSet(dataset, n_folds)
+    curves = list()
+    for data in splitDatas:
+        train_set = list(splitDatas)
+        train_set.remove(data)  # 移除的这个fold作为测试数据
+        train_set = sum(train_set, [])
+        X, y, classes = to_matrix(train_set)
+        trees, oob_votes, importances = train_forest(X, y, classes, max_depth, min_size, sample_size, tree_size, n_features, n_jobs)
+        curves.append(prefix_accuracy(trees, classes, data))
+    return curves
+
+
 if __name__ == '__main__':
 
     # 加载数据
@@ -279,14 +683,22 @@ if __name__ == '__main__':
     min_size = 1  # 决策树的叶子节点最少的元素数量
     sample_size = 1.0  # 做决策树时候的样本的比例
     n_features = 2  # 调参（自己修改） #准确性与多样性之间的权衡
-    for n_trees in [1]:  # 理论上树是越多越好
-        scores = evaluate_algorithm(dataset, random_forest, n_folds, max_depth, min_size, sample_size, n_trees, n_features)
+    n_jobs = 1  # 并行建树的进程数，<= 0 为使用所有的 CPU
+    n_trees_list = [1, 10, 20]  # 理论上树是越多越好
+    # 每一份数据只训练一个 20 棵树的森林，前 1 棵、10 棵树的得分从累计的投票中得到
+    curves = evaluate_prefix(dataset, n_folds, max_depth, min_size, sample_size, max(n_trees_list), n_features, n_jobs)
+    for n_trees in n_trees_list:
+        scores = [curve[n_trees - 1] for curve in curves]
         # 每一次执行本文件时都能产生同一个随机数
         seed(1)
         print('random=', random())
         print('Trees: %d' % n_trees)
         print('Scores: %s' % scores)
         print('Mean Accuracy: %.3f%%' % (sum(scores) / float(len(scores))))
+    # 袋外样本的准确率，只需要训练一次
+    trees, oob_accuracy, oob_predictions, importances = random_forest_oob(dataset, max_depth, min_size, sample_size, max(n_trees_list), n_features, n_jobs)
+    print('OOB Accuracy: %s' % ('%.3f%%' % oob_accuracy if oob_accuracy is not None else None))
+    print('Feature Importances: %s' % [round(float(v), 3) for v in importances])
 # if __name__ == '__main__':
 #
 #     # 加载数据
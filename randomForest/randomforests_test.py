@@ -5,7 +5,8 @@ Date:20161030
 '''
 
 import cPickle as pickle
-from randomforests_train import get_predict
+from randomforests_train import get_predict_flat
+from model_store import load_flat
 
 def load_data(file_name):
     '''导入待分类的数据集
@@ -48,6 +49,16 @@ def load_model(result_file, feature_file):
     
     return trees_result, trees_fiture
     
+def load_model_binary(model_file):
+    '''导入二进制的随机森林模型，节点数组直接映射文件，不生成node对象
+    input:  model_file(string):随机森林模型存储的文件
+    output: flat_trees(list):编译后的随机森林，特征已经映射回原始的列
+            classes(list):类别标签
+            trees_fiture(list):每一棵分类树选择的特征
+    '''
+    flat_trees, meta = load_flat(model_file)
+    return flat_trees, meta['classes'], meta['trees_feature']
+    
 def save_result(data_test, prediction, result_file):
     '''保存最终的预测结果
     input:  data_test(list):待预测的数据
@@ -72,10 +83,10 @@ if __name__ == "__main__":
     data_test = load_data("test_data.txt")
     # 2、导入随机森林模型
     print "--------- 2、load random forest model ----------"
-    trees_result, trees_feature = load_model("result_file", "feature_file")
+    flat_trees, classes, trees_feature = load_model_binary("forest_model")
     # 3、预测
     print "--------- 3、get prediction -----------"
-    prediction = get_predict(trees_result, trees_feature, data_test)
+    prediction = get_predict_flat(flat_trees, classes, data_test)
     # 4、保存最终的预测结果
     print "--------- 4、save result -----------"
     save_result(data_test, prediction, "final_result")
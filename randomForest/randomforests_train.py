@@ -7,116 +7,208 @@ Date:20161030
 import numpy as np
 import random as rd
 from math import log
-from tree import build_tree, predict
+from multiprocessing import Pool, cpu_count
+from tree import grow_tree, to_matrix
+from flat_tree import compile_tree, compile_forest, predict_tree
+from model_store import save_forest, append_forest
+from importance import normalize, oob_permutation_importance
+from data_loader import load_table
 import cPickle as pickle
 
 
 def load_data(file_name):
     '''导入数据
     input:  file_name(string):训练数据保存的文件名
-    output: data_train(list):训练数据
+    output: data_train(array):训练数据，每一行是一个样本，最后一列是标签
     '''
-    data_train = []
-    f = open(file_name)
-    for line in f.readlines():
-        lines = line.strip().split("\t")
-        data_tmp = []
-        for x in lines:
-            data_tmp.append(float(x))
-        data_train.append(data_tmp)
-    f.close()
-    return data_train
-
-
-def choose_samples(data, k):
-    '''
-    input:  data(list):原始数据集
+    return load_table(file_name, "\t")  # 按块解析成一个矩阵，并缓存成.npy
+
+
+def bootstrap_weights(m, n, k, rng=rd):
+    '''用每个样本被抽中的次数表示有放回抽样的样本，不复制样本
+    input:  m(int):样本的个数
+            n(int):每个样本的维数(最后一列是标签)
             k(int):从数据集中选择特征的个数
-    output: data_samples(list):被选择出来的样本
+            rng(Random):抽样用的随机数，默认使用全局的随机状态
+    output: weights(array):每个样本被抽中的次数
             feature(list):被选择的特征index
     '''
-    m, n = np.shape(data)  # 样本的个数和样本特征的个数
     # 1、选择出k个特征的index
     feature = []
     for j in xrange(k):
-        feature.append(rd.randint(0, n - 2))  # n-1列是标签
-    # 2、选择出m个样本的index
-    index = []
+        feature.append(rng.randint(0, n - 2))  # n-1列是标签
+    # 2、选择出m个样本的index，只记录每个样本被抽中的次数
+    weights = np.zeros(m)
     for i in xrange(m):
-        index.append(rd.randint(0, m - 1))
-    # 3、从data中选择出m个样本的k个特征，组成数据集data_samples
-    data_samples = []
-    for i in xrange(m):
-        data_tmp = []
-        for fea in feature:
-            data_tmp.append(data[index[i]][fea])
-        data_tmp.append(data[index[i]][-1])
-        data_samples.append(data_tmp)
-    return data_samples, feature
+        weights[rng.randint(0, m - 1)] += 1
+    return weights, feature
 
 
-def random_forest_training(data_train, trees_num):
-    '''构建随机森林
-    input:  data_train(list):训练数据
+# 进程池中每个 worker 共享的训练数据，在 worker 启动时只传一次，不随每个任务 pickle
+_worker_data = None
+
+
+def _init_worker(X, y, labels):
+    global _worker_data
+    _worker_data = (X, y, labels)
+
+
+def build_seeded_tree(X, y, labels, tree_seed, k):
+    '''用固定的随机种子选择样本和特征并构建一棵分类树
+    input:  X(array):训练数据的特征矩阵
+            y(array):类标签在labels中的下标
+            labels(list):所有的类标签
+            tree_seed(int):这棵树的随机种子
+            k(int):选择特征的个数
+    output: tree:分类树
+            feature(list):该分类树使用到的特征
+            oob(array):袋外样本，即这棵树没有抽中的样本在X中的下标
+            oob_pred(array):这棵树对袋外样本的预测，类标签在labels中的下标
+            importance(array):这棵树归一化的特征重要性，已经映射回原始的列
+    '''
+    rng = rd.Random(tree_seed)  # 每棵树自己的随机状态，不修改全局的随机状态
+    # 1、随机选择m个样本, k个特征，样本用被抽中的次数表示
+    weights, feature = bootstrap_weights(X.shape[0], X.shape[1] + 1, k, rng)
+    # 2、构建每一棵分类树，所有的树共用同一个特征矩阵
+    importance = np.zeros(X.shape[1])
+    tree = grow_tree(X, y, labels, weights, feature, importance)
+    # 3、预测袋外样本
+    oob = np.flatnonzero(weights == 0)
+    oob_pred = predict_tree(compile_tree(tree, feature, list(labels)), X[oob])
+    return tree, feature, oob, oob_pred, normalize(importance)
+
+
+def _build_worker_tree(args):
+    return build_seeded_tree(*(_worker_data + args))
+
+
+def train_forest(X, y, labels, trees_num, n_jobs=1, oob_sets=None):
+    '''构建随机森林，边建树边累计袋外样本的投票
+    input:  X(array):训练数据的特征矩阵
+            y(array):类标签在labels中的下标
+            labels(list):所有的类标签
             trees_num(int):分类树的个数
+            n_jobs(int):并行建树的进程数，1为串行，<=0为使用所有的CPU
+            oob_sets(list):不为None时把每一棵树的袋外样本下标依次追加到这个list中
     output: trees_result(list):每一棵树的最好划分
             trees_feature(list):每一棵树中对原始特征的选择
+            oob_votes(array):oob_votes[i, j]为没有抽中第i个样本的树把它预测为labels[j]的票数
+            importances(array):每一个原始特征的重要性，每一棵树归一化的Gini指数减少量的平均值
     '''
-    trees_result = []  # 构建好每一棵树的最好划分
-    trees_feature = []
-    n = np.shape(data_train)[1]  # 样本的维数
+    n = X.shape[1] + 1  # 样本的维数
     if n > 2:
         k = int(log(n - 1, 2)) + 1  # 设置特征的个数
     else:
         k = 1
+    # 每一棵树的随机种子由当前的随机状态统一生成，串行和并行得到的森林完全一样
+    tree_args = [(rd.randint(0, 2 ** 31 - 1), k) for i in xrange(trees_num)]
+    if n_jobs <= 0:
+        n_jobs = cpu_count()
     # 开始构建每一棵树
-    for i in xrange(trees_num):
-        # 1、随机选择m个样本, k个特征
-        data_samples, feature = choose_samples(data_train, k)
-        # 2、构建每一棵分类树
-        tree = build_tree(data_samples)
-        # 3、保存训练好的分类树
-        trees_result.append(tree)
-        # 4、保存好该分类树使用到的特征
-        trees_feature.append(feature)
+    pool = None
+    if n_jobs > 1 and trees_num > 1:
+        pool = Pool(min(n_jobs, trees_num), initializer=_init_worker, initargs=(X, y, labels))
+        results = pool.imap(_build_worker_tree, tree_args)  # 按顺序返回
+    else:
+        results = (build_seeded_tree(X, y, labels, *args) for args in tree_args)
+
+    trees_result = []
+    trees_feature = []
+    oob_votes = np.zeros((X.shape[0], len(labels)), dtype=np.int64)
+    importances = np.zeros(X.shape[1])
+    try:
+        for tree, feature, oob, oob_pred, importance in results:
+            trees_result.append(tree)  # 保存训练好的分类树
+            trees_feature.append(feature)  # 保存好该分类树使用到的特征
+            oob_votes[oob, oob_pred] += 1  # 每一棵树只给它的袋外样本投票
+            importances += importance
+            if oob_sets is not None:
+                oob_sets.append(oob)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return trees_result, trees_feature, oob_votes, importances / max(len(trees_result), 1)
 
+
+def random_forest_training(data_train, trees_num, n_jobs=1):
+    '''构建随机森林
+    input:  data_train(list):训练数据
+            trees_num(int):分类树的个数
+            n_jobs(int):并行建树的进程数，1为串行，<=0为使用所有的CPU
+    output: trees_result(list):每一棵树的最好划分
+            trees_feature(list):每一棵树中对原始特征的选择
+    '''
+    X, y, labels = to_matrix(data_train)  # 只转换一次，所有的树共用
+    trees_result, trees_feature, oob_votes, importances = train_forest(X, y, labels, trees_num, n_jobs)
     return trees_result, trees_feature
 
 
-def split_data(data_train, feature):
-    '''选择特征
-    input:  data_train(list):训练数据集
-            feature(list):要选择的特征
-    output: data(list):选择出来的数据集
+def random_forest_oob(data_train, trees_num, n_jobs=1, permutation=False):
+    '''构建随机森林，同时用袋外样本估计泛化的正确率，不需要另外的验证数据
+    input:  data_train(list):训练数据
+            trees_num(int):分类树的个数
+            n_jobs(int):并行建树的进程数，1为串行，<=0为使用所有的CPU
+            permutation(bool):为True时importances为袋外置换的特征重要性，按特征并行计算
+    output: trees_result(list):每一棵树的最好划分
+            trees_feature(list):每一棵树中对原始特征的选择
+            oob_rate(float):袋外样本的正确率，只统计有袋外预测的样本，所有样本都没有时为None
+            oob_predict(array):每一个样本的袋外预测，没有树把它留在袋外时为NaN(与randomForest01相同)
+            importances(array):每一个原始特征的重要性：建树时累计的Gini指数减少量，
+                                或者打乱该特征后袋外正确率的下降
     '''
-    m = np.shape(data_train)[0]
-    data = []
+    X, y, labels = to_matrix(data_train)
+    oob_sets = [] if permutation else None
+    perm_seed = rd.randint(0, 2 ** 31 - 1)  # 在建树之前生成，与串行还是并行建树无关
+    trees_result, trees_feature, oob_votes, importances = train_forest(X, y, labels, trees_num, n_jobs, oob_sets)
+    if permutation:
+        flat_trees = [compile_tree(trees_result[i], trees_feature[i], list(labels)) for i in xrange(len(trees_result))]
+        importances = oob_permutation_importance(flat_trees, X, y, oob_sets, len(labels), perm_seed, n_jobs)
+    has_vote = oob_votes.sum(axis=1) > 0  # 没有袋外投票的样本不参与正确率的计算
+    best = np.argmax(oob_votes, axis=1)
+    # 0可能是一个类标签，没有袋外预测的样本用NaN标记
+    oob_predict = np.where(has_vote, np.array(labels, dtype=np.float64)[best], np.nan)
+    oob_rate = float(np.mean(best[has_vote] == y[has_vote])) if has_vote.any() else None
+    return trees_result, trees_feature, oob_rate, oob_predict, importances
 
-    for i in xrange(m):
-        data_x_tmp = []
-        for x in feature:
-            data_x_tmp.append(data_train[i][x])
-        data_x_tmp.append(data_train[i][-1])
-        data.append(data_x_tmp)
-    return data
+
+def warm_start_training(model_file, data_train, trees_num, max_trees=None, n_jobs=1):
+    '''在保存的随机森林上继续训练，只训练新增的树
+    input:  model_file(string):save_forest保存的随机森林模型文件
+            data_train(list):训练新的树的数据，可以是新的数据
+            trees_num(int):新增的分类树的个数
+            max_trees(int):最多保留的树的个数，超过时淘汰最早的树，None表示不淘汰
+            n_jobs(int):并行建树的进程数，1为串行，<=0为使用所有的CPU
+    output: n_trees(int):模型中树的个数
+    '''
+    trees_result, trees_feature = random_forest_training(data_train, trees_num, n_jobs)
+    return append_forest(model_file, trees_result, trees_feature, max_trees)
 
 
 def get_predict(trees_result, trees_fiture, data_train):
-    tree_size = len(trees_result)  # 训练树的数量
-    m = np.shape(data_train)[0]
-
-    result = []
-    for i in xrange(tree_size):
-        clf = trees_result[i]
-        columnIdx = trees_fiture[i]
-        data = split_data(data_train, columnIdx)  # 把要测试的数据，提取出columnIdx列
-        result_i = []
-        for i in xrange(m):
-            test_data = data[i][0:-1]
-            predictVal = predict(test_data, clf)
-            result_i.append((predictVal.keys())[0])
-        result.append(result_i)
-    final_predict = np.sum(result, axis=0)
+    '''随机森林的预测，每一棵树预测的类别相加
+    input:  trees_result(list):训练好的分类树
+            trees_fiture(list):每一棵分类树选择的特征
+            data_train(list):待预测的数据，最后一列为标签
+    output: final_predict(array):每一个样本的预测值
+    '''
+    # 把每一棵树编译成扁平数组，特征 index 映射回原始的列
+    flat_trees, classes = compile_forest(trees_result, trees_fiture)
+    return get_predict_flat(flat_trees, classes, data_train)
+
+
+def get_predict_flat(flat_trees, classes, data_train):
+    '''用编译后的随机森林预测，整个数据集一次性按层推进，每一棵树预测的类别相加
+    input:  flat_trees(list):编译后的分类树，特征已经映射回原始的列
+            classes(list):类别标签
+            data_train(list):待预测的数据，最后一列为标签
+    output: final_predict(array):每一个样本的预测值
+    '''
+    X = np.array(data_train)[:, :-1]
+    labels = np.array(classes, dtype=np.float64)
+    final_predict = np.zeros(np.shape(X)[0])
+    for flat in flat_trees:
+        final_predict += labels[predict_tree(flat, X)]
     return final_predict
 
 
@@ -151,12 +243,16 @@ if __name__ == "__main__":
     data_train = load_data("data10.txt")
     # 2、训练random_forest模型
     print "----------- 2、random forest training ------------"
-    trees_result, trees_feature = random_forest_training(data_train, 3)
+    trees_result, trees_feature, oob_rate, oob_predict, importances = random_forest_oob(data_train, 3)
     # 3、得到训练的准确性
     print "------------ 3、get prediction correct rate ------------"
     result = get_predict(trees_result, trees_feature, data_train)
     corr_rate = cal_correct_rate(data_train, result)
     print "\t------correct rate: ", corr_rate
+    print "\t------oob correct rate: ", oob_rate
+    print "\t------feature importances: ", importances
     # 4、保存最终的随机森林模型
     print "------------ 4、save model -------------"
     save_model(trees_result, trees_feature, "result_file", "feature_file")
+    # 5、保存二进制的随机森林模型，预测时用mmap直接加载
+    save_forest(trees_result, trees_feature, "forest_model")
@@ -0,0 +1,48 @@
+# coding:UTF-8
+'''
+binning的测试：连续特征用满max_bins个箱子，取值少的特征每个取值一个箱子
+
+    python -m unittest test_binning
+'''
+import unittest
+import numpy as np
+from binning import bin_features, n_bins
+
+
+class BinFeaturesTest(unittest.TestCase):
+
+    def test_continuous_uses_all_bins(self):
+        X = np.random.RandomState(0).rand(3000, 2)
+        for max_bins in (4, 256):
+            X_binned, cuts = bin_features(X, max_bins)
+            for j in range(X.shape[1]):
+                self.assertEqual(len(cuts[j]), max_bins - 1)
+                counts = np.bincount(X_binned[:, j], minlength=max_bins)
+                self.assertEqual(len(counts), max_bins)
+                self.assertTrue(counts.min() > 0)
+            self.assertEqual(n_bins(cuts), max_bins)
+
+    def test_bins_match_cuts(self):
+        X = np.random.RandomState(1).randn(1000, 3)
+        X_binned, cuts = bin_features(X, 16)
+        for j in range(X.shape[1]):
+            for t in range(1, len(cuts[j]) + 1):
+                # 箱子 < t 等价于 x < cuts[j][t - 1]
+                np.testing.assert_array_equal(X_binned[:, j] < t, X[:, j] < cuts[j][t - 1])
+
+    def test_few_values(self):
+        X = np.array([[1.0], [2.0], [2.0], [5.0]])
+        X_binned, cuts = bin_features(X, 256)
+        self.assertEqual(list(cuts[0]), [2.0, 5.0])
+        self.assertEqual(list(X_binned[:, 0]), [0, 1, 1, 2])
+
+    def test_many_equal_minimum(self):
+        # 一半的样本等于最小值时，不产生左边为空的切分点
+        x = np.r_[np.zeros(500), np.random.RandomState(2).rand(500) + 1]
+        X_binned, cuts = bin_features(x[:, None], 8)
+        self.assertTrue(cuts[0].min() > 0)
+        self.assertTrue(np.bincount(X_binned[:, 0]).min() > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+# coding:UTF-8
+'''
+flat_tree的测试：编译后的树和原来的树预测相同，空的树给出明确的错误
+
+    python -m unittest test_flat_tree
+'''
+import unittest
+import numpy as np
+from tree import node, build_tree, predict
+from flat_tree import compile_tree, predict_tree
+
+
+class CompileTreeTest(unittest.TestCase):
+
+    def test_same_prediction(self):
+        rng = np.random.RandomState(0)
+        X = rng.randint(0, 4, (200, 3)).astype(np.float64)
+        y = np.where(X[:, 0] + X[:, 1] > 3, 1.0, -1.0)
+        data = np.column_stack([X, y]).tolist()
+        tree = build_tree(data)
+        classes = []
+        flat = compile_tree(tree, classes=classes)
+        results = [predict(row, tree) for row in data]  # 叶节点是 {类别: 个数}
+        expected = [max(r, key=r.get) for r in results]
+        got = [classes[i] for i in predict_tree(flat, X)]
+        self.assertEqual(got, expected)
+
+    def test_single_leaf(self):
+        flat = compile_tree(node(results={1.0: 5}), classes=[])
+        self.assertEqual(list(flat['feature']), [-1])
+        self.assertEqual(flat['depth'], 0)
+
+    def test_empty_tree(self):
+        self.assertRaises(ValueError, compile_tree, build_tree([]))
+        self.assertRaises(ValueError, compile_tree, node(), None, [])
+
+    def test_too_few_features(self):
+        tree = node(fea=2, value=0.5, left=node(results={1.0: 1}), right=node(results={-1.0: 1}))
+        flat = compile_tree(tree, classes=[])
+        self.assertRaises(ValueError, predict_tree, flat, np.zeros((3, 2)))
+        self.assertEqual(len(predict_tree(flat, np.zeros((3, 3)))), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ Date:20161030
 @author: zhaozhiyong
 '''
 from math import pow
+import numpy as np
 
 
 class node:
@@ -69,6 +70,119 @@ def cal_gini_index(data):
     return gini
 
 
+def to_matrix(data):
+    '''把数据集转换成一个连续的特征矩阵和整数编码的类标签
+    input:  data(list):数据集，最后一列为类标签
+    output: X(array):特征矩阵
+            y(array):类标签在labels中的下标
+            labels(list):所有的类标签
+    '''
+    if isinstance(data, np.ndarray):  # load_data读入的矩阵，直接按列处理
+        labels, y = np.unique(data[:, -1], return_inverse=True)
+        X = np.ascontiguousarray(data[:, :-1], dtype=np.float64)
+        return X, y.astype(np.intp), [float(label) for label in labels]
+    labels = sorted(set(x[-1] for x in data))
+    label_index = dict((label, i) for i, label in enumerate(labels))
+    X = np.array([x[:-1] for x in data], dtype=np.float64)
+    y = np.array([label_index[x[-1]] for x in data], dtype=np.intp)
+    return X, y, labels
+
+
+def best_split(X, y, n_label, sub, weights, feature):
+    '''在sub这些样本上找出Gini指数增加量最大的划分，每个特征只排序一次，扫描累计的类别个数
+    input:  X(array):特征矩阵
+            y(array):类标签的下标
+            n_label(int):类标签的个数
+            sub(array):当前节点的样本在X中的下标
+            weights(array):每个样本的权重(被抽中的次数)
+            feature(list):参与划分的特征在X中的列
+    output: (best_gain, fea, value)(tuple):Gini指数的增加量，划分的特征在feature中的位置和值，
+            X[:, feature[fea]] >= value的样本为右子树
+    '''
+    onehot = np.eye(n_label)[y[sub]] * weights[sub][:, None]
+    total = onehot.sum(axis=0)
+    n = total.sum()  # 按权重计算的样本个数
+    current_gini = 1 - float((total ** 2).sum()) / pow(n, 2)  # 当前的Gini指数
+
+    best_gain, best_fea, best_value = 0.0, -1, None
+    for fea in range(len(feature)):
+        values = X[sub, feature[fea]]
+        order = np.argsort(values, kind='mergesort')
+        values = values[order]
+        counts = np.cumsum(onehot[order], axis=0)  # counts[i]为排序后前i+1个样本中各类别的权重之和
+        # 左子树为严格小于切分值的样本，左右子树都不能为空，所以从第二个不同的取值开始
+        first = np.flatnonzero(values[1:] != values[:-1]) + 1
+        if len(first) == 0:
+            continue
+        left = counts[first - 1]
+        right = total - left
+        n_left = left.sum(axis=1)
+        n_right = n - n_left
+        gini_left = 1 - (left ** 2).sum(axis=1) / n_left ** 2
+        gini_right = 1 - (right ** 2).sum(axis=1) / n_right ** 2
+        gain = current_gini - (n_left * gini_left + n_right * gini_right) / n
+        i = np.argmax(gain)
+        if gain[i] > best_gain:
+            best_gain, best_fea, best_value = gain[i], fea, float(values[first[i]])
+    return best_gain, best_fea, best_value
+
+
+def partition(X, idx, start, end, fea, value):
+    '''把idx[start:end]原地划分成左右子树，X[:, fea] < value的样本下标在前
+    input:  X(array):特征矩阵
+            idx(array):样本下标
+            start, end(int):当前节点在idx中的范围
+            fea(int):划分的特征
+            value(float):划分的值
+    output: mid(int):左右子树的分界位置
+    '''
+    sub = idx[start:end]
+    mask = X[sub, fea] < value
+    idx[start:end] = np.concatenate((sub[mask], sub[~mask]))
+    return start + np.count_nonzero(mask)
+
+
+def grow_tree(X, y, labels, weights=None, feature=None, importance=None):
+    '''在共享的特征矩阵上构建树
+    input:  X(array):特征矩阵
+            y(array):类标签在labels中的下标
+            labels(list):所有的类标签
+            weights(array):每个样本的权重，有放回抽样时为样本被抽中的次数，None表示都为1
+            feature(list):参与划分的特征在X中的列，None表示所有的列；
+                          节点的fea为特征在feature中的位置
+            importance(array):长度为X的列数，不为None时把每次划分的Gini指数减少量(乘以样本权重之和)
+                              累加到划分特征在X中的列上
+    output: node:树的根结点
+    '''
+    if weights is None:
+        weights = np.ones(len(y))
+    if feature is None:
+        feature = range(X.shape[1])
+    # 所有节点共用一个特征矩阵，每个节点只对应idx中的一段，划分时原地重排idx
+    idx = np.flatnonzero(weights)  # 权重为0(没有被抽中)的样本不参与建树
+    root = node()
+    stack = [(root, 0, len(idx))]  # 用栈代替递归，树再深也不会超过递归的层数限制
+    while stack:
+        tree, start, end = stack.pop()
+        sub = idx[start:end]
+        # 1、找到最好的划分
+        best_gain, fea, value = best_split(X, y, len(labels), sub, weights, feature)
+        # 2、判断划分是否结束
+        if best_gain > 0:
+            if importance is not None:
+                importance[feature[fea]] += best_gain * weights[sub].sum()
+            mid = partition(X, idx, start, end, feature[fea], value)
+            tree.fea, tree.value = fea, value
+            tree.right, tree.left = node(), node()
+            stack.append((tree.right, mid, end))
+            stack.append((tree.left, start, mid))
+        else:
+            counts = np.bincount(y[sub], weights=weights[sub], minlength=len(labels))
+            # 返回当前的类别标签作为最终的类别标签
+            tree.results = dict((labels[i], int(counts[i])) for i in np.flatnonzero(counts))
+    return root
+
+
 def build_tree(randomData):
     '''构建树
     input:  data(list):训练样本
@@ -77,43 +191,8 @@ def build_tree(randomData):
     # 构建决策树，函数返回该决策树的根节点
     if len(randomData) == 0:
         return node()
-
-    # 1、计算当前的Gini指数
-    currentGini = cal_gini_index(randomData)
-
-    bestGain = 0.0
-    bestCriteria = None  # 存储最佳切分属性以及最佳切分点
-    bestSets = None  # 存储切分后的两个数据集
-
-    column_num = len(randomData[0]) - 1  # 样本中特征的个数
-    # 2、找到最好的划分
-    for cloumnIdx in range(0, column_num):
-        # 2.1、取得fea特征处所有可能的取值
-        feature_values = {}  # 在fea位置处可能的取值
-        for oneData in randomData:  # 对每一个样本
-            feature_values[oneData[cloumnIdx]] = 1  # 存储特征fea处所有可能的取值
-
-        # 2.2、针对每一个可能的取值，尝试将数据集划分，并计算Gini指数
-        for value in feature_values.keys():  # 遍历该属性的所有切分点
-            # 2.2.1、 根据fea特征中的值value将数据集划分成左右子树
-            (set_1, set_2) = split_tree(randomData, cloumnIdx, value)
-            # 2.2.2、计算当前的Gini指数
-            nowGini = float(len(set_1) * cal_gini_index(set_1) + len(set_2) * cal_gini_index(set_2)) / len(randomData)
-            # 2.2.3、计算Gini指数的增加量
-            gain = currentGini - nowGini
-            # 2.2.4、判断此划分是否比当前的划分更好
-            if gain > bestGain and len(set_1) > 0 and len(set_2) > 0:
-                bestGain = gain
-                bestCriteria = (cloumnIdx, value)
-                bestSets = (set_1, set_2)
-
-    # 3、判断划分是否结束
-    if bestGain > 0:
-        right = build_tree(bestSets[0])
-        left = build_tree(bestSets[1])
-        return node(fea=bestCriteria[0], value=bestCriteria[1], right=right, left=left)
-    else:
-        return node(results=label_uniq_cnt(randomData))  # 返回当前的类别标签作为最终的类别标签
+    X, y, labels = to_matrix(randomData)
+    return grow_tree(X, y, labels)
 
 
 def predict(sample, tree):
@@ -1,5 +1,6 @@
 # --*-- encoding:utf-8 --*--
 
+import sys
 import tree
 
 
@@ -13,5 +14,10 @@ def readData(filename):
 
 if __name__ == "__main__":
     dataSet, labels = readData("data")
-    inTree = tree.createTree(dataSet, labels)
-    tree.createPlot(inTree)
+    inTree = tree.createTree(dataSet, labels[:])
+    # 编译成节点表，对所有样本批量分类
+    compiledTree = tree.compileTree(inTree, labels)
+    predictions = tree.classifyBatch(compiledTree, tree.encodeSamples(compiledTree, dataSet))
+    print(sum(p == example[-1] for p, example in zip(predictions, dataSet)) / float(len(dataSet)))
+    # python test041.py lenses.png 保存成图片(不需要显示器)，不带参数时直接显示
+    tree.createPlot(inTree, sys.argv[1] if len(sys.argv) > 1 else None)
@@ -2,7 +2,15 @@
 
 import math
 import operator
+import os
+import sys
+import numpy as np
+import matplotlib
+
+if sys.platform.startswith('linux') and not os.environ.get('DISPLAY'):
+    matplotlib.use('Agg')  # 没有显示器(如CI)时只能保存成文件
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import pickle
 
 
@@ -41,27 +49,55 @@ def splitDataSet(dataSet, idx, value):
     return retDataSet
 
 
-def chooseBestFeatureToSplit(dataSet):
-    numFeatures = len(dataSet[0]) - 1  # 得到所有属性，特征
-    baseEntropy = calcShannonEnt(dataSet)  # 最大的熵
+# 把每一列的取值编码成整数，columns[j]是第j列的编码，values[j]是编码对应的原始取值
+def encodeDataSet(dataSet):
+    numFeatures = len(dataSet[0]) - 1
+    columns = []
+    values = []
+    for j in range(numFeatures + 1):
+        uniq, codes = np.unique(np.array([example[j] for example in dataSet]), return_inverse=True)
+        columns.append(codes.astype(np.intp))
+        values.append(uniq.tolist())
+    y = columns.pop()  # 最后一列是类别标签
+    classes = values.pop()
+    return columns, values, y, classes
+
+
+# 按列联表计算熵，counts的最后一维是每个类别的个数
+def calcEntropyFromCounts(counts):
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum(axis=-1)
+    prob = counts / np.maximum(total, 1)[..., np.newaxis]
+    logProb = np.log2(np.where(prob > 0, prob, 1))  # 0 * log(0) 按0计算
+    return -(prob * logProb).sum(axis=-1)
+
+
+# 在rows这些样本上从features中选出信息增益最大的特征，返回它在features中的位置
+def chooseBestFeature(columns, values, y, numClasses, rows, features):
+    classCounts = np.bincount(y[rows], minlength=numClasses)
+    baseEntropy = calcEntropyFromCounts(classCounts)
     bestInfoGain = 0.0
     bestFeature = -1
-    for rowIdx in range(numFeatures):
-        featureValueList = [example[rowIdx] for example in dataSet]  # 把第rowIdx列所有的值取出来
-        featureValueSet = set(featureValueList)
-        newEntropy = 0.0
-        for featureValue in featureValueSet:
-            subDataSet = splitDataSet(dataSet, rowIdx, featureValue)
-            prob = len(subDataSet) / float(len(dataSet))
-            subShannon = calcShannonEnt(subDataSet)  # 剩下所有数据的熵
-            newEntropy += prob * subShannon  # 该分类在总的数据下熵，值越小，说明信息的无序程度越小
+    for i in range(len(features)):
+        numValues = len(values[features[i]])
+        # 一遍扫描得到 特征取值 x 类别 的列联表
+        table = np.bincount(columns[features[i]][rows] * numClasses + y[rows],
+                            minlength=numValues * numClasses).reshape(numValues, numClasses)
+        valueCounts = table.sum(axis=1)
+        newEntropy = np.dot(valueCounts / float(len(rows)), calcEntropyFromCounts(table))
         infoGain = baseEntropy - newEntropy  # 值越大越好，说明newEntropy越小，baseEntropy不变
         if (infoGain > bestInfoGain):
             bestInfoGain = infoGain
-            bestFeature = rowIdx
+            bestFeature = i
     return bestFeature
 
 
+def chooseBestFeatureToSplit(dataSet):
+    columns, values, y, classes = encodeDataSet(dataSet)
+    rows = np.arange(len(dataSet))
+    return chooseBestFeature(columns, values, y, len(classes), rows, range(len(columns)))
+
+
 # 挑出labels里面，出现次数最多的label
 def getMaxcountLabel(labels):
     labelMap = {}  # key=标签，value=出现的次数
@@ -75,40 +111,140 @@ def getMaxcountLabel(labels):
     return sortedLabelMap[0][0]
 
 
-def createTree(dataSet, labels):
-    classList = [example[-1] for example in dataSet]  # 取出所有标签
+# 递归时只传样本的下标和剩下的特征，不复制样本
+def createSubTree(columns, values, y, classes, rows, features, labels):
+    classCounts = np.bincount(y[rows], minlength=len(classes))
+    if classCounts.max() == len(rows):  # 如果只剩下同一类标签了，就不能再划分类别了，直接返回
+        return classes[y[rows[0]]]
+    if len(features) == 0:  # 只有一个标签了
+        return classes[classCounts.argmax()]
+    bestIdx = chooseBestFeature(columns, values, y, len(classes), rows, features)  # 获取最佳分类列在features中的位置
+    bestFeature = features[bestIdx]
+    bestFeatureLabel = labels[bestFeature]  # 对应的标签
+    myTree = {bestFeatureLabel: {}}
+    subFeatures = features[:]
+    del (subFeatures[bestIdx])  # 剔除已经知道
+    # 按最佳特征的取值把样本下标分组，只有出现的取值才有子树
+    column = columns[bestFeature][rows]
+    order = np.argsort(column, kind='mergesort')
+    sortedRows, sortedColumn = rows[order], column[order]
+    bounds = np.flatnonzero(np.diff(sortedColumn)) + 1
+    for subRows in np.split(sortedRows, bounds):
+        rowValue = values[bestFeature][columns[bestFeature][subRows[0]]]
+        myTree[bestFeatureLabel][rowValue] = createSubTree(columns, values, y, classes, subRows, subFeatures, labels)
+    return myTree
 
-    label = classList[0]  # 取出第一个标签
-    labelCount = classList.count(label)  # 取出label标签的个数
 
-    if labelCount == len(classList):  # 如果只剩下同一类标签了，就不能再划分类别了，直接返回
-        return classList[0]
-    if len(dataSet[0]) == 1:  # 只有一个标签了
-        return getMaxcountLabel(classList)
-    bestFeatureRowIdx = chooseBestFeatureToSplit(dataSet)  # 获取最佳分类列的下标
-    bestFeatureLabel = labels[bestFeatureRowIdx]  # 对应的标签
-    myTree = {bestFeatureLabel: {}}
-    del (labels[bestFeatureRowIdx])  # 剔除已经知道
-    allFeatureValues = [example[bestFeatureRowIdx] for example in dataSet]  # 通过列的下标，获取该下标对应列的所有值
-
-    bestFeatureRowVals = set(allFeatureValues)
-    for rowValue in bestFeatureRowVals:
-        subLabels = labels[:]
-        subDataSet = splitDataSet(dataSet, bestFeatureRowIdx, rowValue)
-        myTree[bestFeatureLabel][rowValue] = createTree(subDataSet, subLabels)
+def createTree(dataSet, labels):
+    columns, values, y, classes = encodeDataSet(dataSet)  # 每一列只编码一次
+    rows = np.arange(len(dataSet))
+    myTree = createSubTree(columns, values, y, classes, rows, list(range(len(columns))), labels[:])
+    if type(myTree).__name__ == 'dict':
+        labels.remove(myTree.keys()[0])  # 和原来一样，剔除根节点已经使用的标签
     return myTree
 
 
+'''下面部分是把树编译成整数编码的节点表，批量分类'''
+
+
+# 递归编译一个节点，返回节点的下标、子树中每个类别的叶节点个数和子树的深度
+def compileNode(subTree, featLabels, table):
+    idx = len(table['feature'])
+    table['feature'].append(-1)
+    table['children'].append({})
+    table['leafClass'].append(-1)
+    if type(subTree).__name__ != 'dict':  # 叶节点
+        if subTree not in table['classes']:
+            table['classes'].append(subTree)
+        classIdx = table['classes'].index(subTree)
+        table['leafClass'][idx] = classIdx
+        return idx, {classIdx: 1}, 0
+    featLabel = subTree.keys()[0]
+    fea = featLabels.index(featLabel)
+    table['feature'][idx] = fea
+    valueMap = table['valueMaps'][fea]
+    votes = {}
+    maxDepth = 0
+    for value, child in subTree[featLabel].items():
+        if value not in valueMap:
+            valueMap[value] = len(valueMap)
+        childIdx, childVotes, childDepth = compileNode(child, featLabels, table)
+        table['children'][idx][valueMap[value]] = childIdx
+        for classIdx in childVotes:
+            votes[classIdx] = votes.get(classIdx, 0) + childVotes[classIdx]
+        maxDepth = max(maxDepth, childDepth)
+    # 没有见过的取值走向一个单独的叶节点，类别为子树中叶节点最多的类别
+    fallback = len(table['feature'])
+    table['feature'].append(-1)
+    table['children'].append({})
+    table['leafClass'].append(max(votes, key=votes.get))
+    table['fallback'][idx] = fallback
+    return idx, votes, maxDepth + 1
+
+
+# 把createTree得到的字典树编译成节点表，featLabels是建树时完整的特征名列表(createTree会删除其中的根节点标签，需要传入副本)
+def compileTree(inputTree, featLabels):
+    table = {'feature': [], 'children': [], 'leafClass': [], 'fallback': {}, 'classes': [],
+             'valueMaps': [{} for i in range(len(featLabels))]}
+    root, votes, depth = compileNode(inputTree, featLabels, table)
+    numNodes = len(table['feature'])
+    width = max([0] + [len(valueMap) for valueMap in table['valueMaps']]) + 1  # 最后一列是没有见过的取值
+    # 叶节点的所有取值都指向自己，所有样本可以一起推进depth层
+    child = np.tile(np.arange(numNodes, dtype=np.int32)[:, np.newaxis], (1, width))
+    for idx in table['fallback']:
+        child[idx, :] = table['fallback'][idx]
+        for code in table['children'][idx]:
+            child[idx, code] = table['children'][idx][code]
+    return {'feature': np.array(table['feature'], dtype=np.int32),
+            'child': child,
+            'leafClass': np.array(table['leafClass'], dtype=np.int32),
+            'classes': table['classes'],
+            'valueMaps': table['valueMaps'],
+            'depth': depth}
+
+
+# 用编译时的取值表把样本编码成整数矩阵，没有见过的取值编码成最后一列(走向多数类别的叶节点)
+def encodeSamples(compiledTree, dataSet):
+    numFeatures = len(compiledTree['valueMaps'])
+    unseen = compiledTree['child'].shape[1] - 1
+    codes = np.empty((len(dataSet), numFeatures), dtype=np.intp)
+    for j in range(numFeatures):
+        if isinstance(dataSet, np.ndarray):
+            column = dataSet[:, j]
+        else:
+            column = np.array([example[j] for example in dataSet])
+        # 每个不同的取值只查一次取值表
+        uniq, inverse = np.unique(column, return_inverse=True)
+        valueMap = compiledTree['valueMaps'][j]
+        lookup = np.array([valueMap.get(value, unseen) for value in uniq.tolist()], dtype=np.intp)
+        codes[:, j] = lookup[inverse]
+    return codes
+
+
+# 对encodeSamples编码后的所有样本一起分类，返回每个样本的类别
+def classifyBatch(compiledTree, codes):
+    codes = np.asarray(codes, dtype=np.intp)
+    feature = np.maximum(compiledTree['feature'], 0)  # 叶节点随便取一列，反正指向自己
+    child = compiledTree['child']
+    numFeatures = codes.shape[1]
+    flatCodes = codes.ravel()
+    base = np.arange(codes.shape[0]) * numFeatures
+    nodeIdx = np.zeros(codes.shape[0], dtype=np.intp)
+    for i in range(compiledTree['depth']):
+        nodeIdx = child[nodeIdx, flatCodes[base + feature[nodeIdx]]]
+    classes = np.array(compiledTree['classes'], dtype=object)
+    return classes[compiledTree['leafClass'][nodeIdx]].tolist()
+
+
 '''下面部分是展示树'''
 
 descNode = dict(boxstyle="sawtooth", fc="0.8")
 leafNode = dict(boxstyle="round4", fc="0.8")
-arrow_args = dict(arrowstyle="<-")
+edgeColor = "0.3"
 
 
-def plotNode(nodeTxt, centerPt, parentPt, nodeType):
-    createPlot.ax1.annotate(nodeTxt, xy=parentPt, xycoords='axes fraction', xytext=centerPt, textcoords='axes fraction',
-                            va="center", ha="center", bbox=nodeType, arrowprops=arrow_args)
+def plotNode(ax, nodeTxt, centerPt, nodeType):
+    ax.text(centerPt[0], centerPt[1], nodeTxt, va="center", ha="center", bbox=nodeType)
 
 
 def getNumLeafs(myTree):
@@ -137,42 +273,68 @@ def getTreeDepth(myTree):
     return maxDepth
 
 
-def plotMidText(cntrPt, parentPt, txtString):
+def plotMidText(ax, cntrPt, parentPt, txtString):
     xMid = (parentPt[0] - cntrPt[0]) / 2.0 + cntrPt[0]
     yMid = (parentPt[1] - cntrPt[1]) / 2.0 + cntrPt[1]
-    createPlot.ax1.text(xMid, yMid, txtString)
-
-
-def plotTree(myTree, parentPt, nodeTxt):
-    numLeafs = getNumLeafs(myTree)
-    depth = getTreeDepth(myTree)
-    firstStr = myTree.keys()[0]
-    cntrPt = (plotTree.xOff + (1.0 + float(numLeafs)) / 2.0 / plotTree.totalW, plotTree.yOff)
-    plotMidText(cntrPt, parentPt, nodeTxt)
-    plotNode(firstStr, cntrPt, parentPt, descNode)
-    secondDict = myTree[firstStr]
-    plotTree.yOff = plotTree.yOff - 1.0 / plotTree.totalD
+    ax.text(xMid, yMid, txtString)
+
+
+# 递归布局一个节点：叶节点依次占一个横向的位置，内部节点在它所有叶节点的中间，返回子树的叶节点个数和深度
+def layoutNode(subTree, level, parent, edgeText, nodes, leafCursor):
+    idx = len(nodes)
+    if type(subTree).__name__ != 'dict':
+        nodes.append([str(subTree), leafCursor[0] + 0.5, level, parent, edgeText, True])
+        leafCursor[0] += 1
+        return 1, 0
+    firstStr = subTree.keys()[0]
+    nodes.append([str(firstStr), 0.0, level, parent, edgeText, False])
+    firstLeaf = leafCursor[0]
+    numLeafs = 0
+    maxDepth = 0
+    secondDict = subTree[firstStr]
     for key in secondDict.keys():
-        if type(secondDict[key]).__name__ == 'dict':
-            plotTree(secondDict[key], cntrPt, str(key))
-        else:
-            plotTree.xOff = plotTree.xOff + 1.0 / plotTree.totalW
-            plotNode(secondDict[key], (plotTree.xOff, plotTree.yOff), cntrPt, leafNode)
-            plotMidText((plotTree.xOff, plotTree.yOff), cntrPt, str(key))
-    plotTree.yOff = plotTree.yOff + 1.0 / plotTree.totalD
-
-
-def createPlot(inTree):
-    fig = plt.figure(1, facecolor='white')
+        childLeafs, childDepth = layoutNode(secondDict[key], level + 1, idx, str(key), nodes, leafCursor)
+        numLeafs += childLeafs
+        maxDepth = max(maxDepth, childDepth + 1)
+    nodes[idx][1] = firstLeaf + numLeafs / 2.0
+    return numLeafs, maxDepth
+
+
+# 一遍遍历得到所有节点的叶节点个数、深度和坐标，坐标和原来的createPlot一样是[0, 1]之间的比例
+# 返回 [(文字, x, y, 父节点下标, 边上的文字, 是否叶节点)], 叶节点个数, 深度
+def layoutTree(inTree):
+    nodes = []
+    totalW, totalD = layoutNode(inTree, 0, -1, '', nodes, [0])
+    totalW, totalD = float(max(totalW, 1)), float(max(totalD, 1))
+    layout = [(text, x / totalW, 1.0 - level / totalD, parent, edgeText, isLeaf)
+              for text, x, level, parent, edgeText, isLeaf in nodes]
+    return layout, int(totalW), int(totalD)
+
+
+# 画出整棵树，fileName为None时显示，否则按扩展名保存成PNG/SVG等文件，不需要显示器
+def createPlot(inTree, fileName=None):
+    layout, totalW, totalD = layoutTree(inTree)
+    # 树越大图越大，保证文字不重叠；PNG每一边不超过32000像素
+    figSize = (min(max(8.0, 0.8 * totalW), 320.0), min(max(6.0, 1.2 * totalD), 320.0))
+    fig = plt.figure(1, facecolor='white', figsize=figSize if fileName else None)
     fig.clf()
     axprops = dict(xticks=[], yticks=[])
-    createPlot.ax1 = plt.subplot(111, frameon=False, **axprops)
-    plotTree.totalW = float(getNumLeafs(inTree))
-    plotTree.totalD = float(getTreeDepth(inTree))
-    plotTree.xOff = -0.5 / plotTree.totalW;
-    plotTree.yOff = 1.0
-    plotTree(inTree, (0.5, 1.0), '')
-    plt.show()
+    ax = plt.subplot(111, frameon=False, **axprops)
+    ax.set_xlim(0, 1)
+    ax.set_ylim(-0.5 / totalD, 1.0 + 0.5 / totalD)
+    # 所有的边放在一个LineCollection中一次画出
+    edges = [((layout[parent][1], layout[parent][2]), (x, y))
+             for text, x, y, parent, edgeText, isLeaf in layout if parent >= 0]
+    ax.add_collection(LineCollection(edges, colors=edgeColor, linewidths=0.8, zorder=1))
+    for text, x, y, parent, edgeText, isLeaf in layout:
+        plotNode(ax, text, (x, y), leafNode if isLeaf else descNode)
+        if parent >= 0:
+            plotMidText(ax, (x, y), (layout[parent][1], layout[parent][2]), edgeText)
+    if fileName:
+        fig.savefig(fileName, bbox_inches='tight')
+        plt.close(fig)
+    else:
+        plt.show()
 
 
 '''读取和存储树'''